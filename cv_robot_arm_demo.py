@@ -15,7 +15,8 @@ def main(args):
             if not ret:
                 break
             # 进行检测
-            result_image, rect_list = detector.infer(frame)
+            detections = detector.infer(frame)
+            result_image = detector.draw_result(frame, detections)
             # 显示结果
             cv2.imshow('frame', result_image)
             if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -26,7 +27,8 @@ def main(args):
         # 读取图像
         image = cv2.imread(args.image)
         # 进行检测
-        result_image, rect_list = detector.infer(image)
+        detections = detector.infer(image)
+        result_image = detector.draw_result(image, detections)
         # 显示结果
         cv2.imwrite('result.jpg', result_image)
         # cv2.imshow('frame', result_image)
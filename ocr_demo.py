@@ -18,9 +18,7 @@ class CameraOCR:
         self.cap = cv2.VideoCapture(22, cv2.CAP_V4L)  # 根据
 
     def process_frame(self, frame):
-        temp_path = "temp_frame.jpg"
-        cv2.imwrite(temp_path, frame)
-        return self.ocr(temp_path)
+        return self.ocr(frame)
 
     def start_camera(self):
         while True:
@@ -1,8 +1,7 @@
-import time
 import threading
-import cv2
+import os
 
-from spacemit_cv import ElephantDetection
+from spacemit_cv import ElephantDetection, DetectionPipeline, ByteTracker, SceneChangeGate
 from tools.elephant.elephant_function_motion_control import ElephantMotionControl
 from tools.elephant.elephant_function_map import *
 from spacemit_orc.OCRVideoCapture import recognize_text_from_camera
@@ -10,12 +9,19 @@ from spacemit_orc.OCRVideoCapture import recognize_text_from_camera
 detector = ElephantDetection('spacemit_cv/best.onnx')
 motion_control = ElephantMotionControl()
 
-show_camera = True
-latest_frame = None
-lock = threading.Lock()
+show_window = bool(os.environ.get('DISPLAY'))  # Headless stations skip drawing and imshow
 selected_class = None  # Record the name of the object selected by the user
 target_cls_name = None  # Initially there is no target category
-cap = None
+
+# Capture -> detection -> display pipeline of camera 20, the camera is released while the arm is moving
+# The tracker keeps a live table of the objects in view so grabbing does not need another inference
+# Every box the detector reports may start a track, otherwise objects scored between class_conf and the default
+# track threshold are never tracked and each grab of them falls back to a fresh inference
+tracker = ByteTracker(track_thresh=detector.class_conf)
+# The shelf is static most of the time, detection only reruns when the scene changes or after the arm moved
+scene_gate = SceneChangeGate(pixel_thresh=12, change_ratio=0.01, max_skip=30)
+pipeline = DetectionPipeline(detector, camera_index=20, pause_when=motion_control.is_busy, show_window=show_window,
+                             tracker=tracker, gate=scene_gate)
 
 # Defining valid object classes
 valid_classes = [
@@ -26,68 +32,16 @@ valid_classes = [
 
 def camera_display_loop():
     """
-    Video stream of camera flange at the end of the robotic arm - thread display
+    Video stream of camera flange at the end of the robotic arm - capture, detection and display run on their own threads
     """
-    global cap, show_camera, latest_frame, selected_class
-
-    while show_camera:
-        # If in the capture phase, close the camera 20
-        if motion_control.is_busy():
-            if cap:
-                cap.release()
-                cap = None
-                cv2.destroyAllWindows()
-            time.sleep(0.1)
-            continue
-
-        # If it is not open, open it once
-        if cap is None:
-            cap = cv2.VideoCapture(20, cv2.CAP_V4L)
-            if not cap.isOpened():
-                print("❌ 无法打开摄像头20")
-                time.sleep(1)
-                continue
-
-        ret, frame = cap.read()
-        if not ret:
-            continue
-
-        result_image, rect_list, classnames = detector.infer(frame)
-
-        # Change box color based on user selection
-        for idx, rect in enumerate(rect_list):
-            label = classnames[idx]
-            (x1, y1), width, height, *_ = rect
-
-            # If the box belongs to the object selected by the user, it turns red
-            if selected_class and label == selected_class:
-                color = (0, 0, 255)  # 红色框
-
-                # Draw the box
-                pt1 = (int(x1), int(y1))
-                pt2 = (int(x1 + width), int(y1 + height))
-                cv2.rectangle(result_image, pt1, pt2, color, 2)
-                cv2.putText(result_image, label, (int(x1), int(y1 - 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-
-        with lock:
-            latest_frame = frame.copy()
-
-        cv2.imshow("result", result_image)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            show_camera = False
-            break
-
-        time.sleep(0.01)
-
-    if cap:
-        cap.release()
-    cv2.destroyAllWindows()
+    pipeline.start()
+    pipeline.join()
 
 def user_input_loop():
     """
     用户输入选择
     """
-    global cap, latest_frame, selected_class
+    global selected_class
     while True:
         try:
             user_input = input("\n1. 请输入待抓取物体类别（可选类别：jeep, apple, banana, bed, grape......）\n2. 开始结算（请输入'start checkout' 开始结算，请在30秒内使用超市抵用券进行结算）\n3. 输入 q 退出：")
@@ -96,26 +50,25 @@ def user_input_loop():
             if not user_input:
                 continue
             if user_input.lower() == 'start checkout':  # If you enter 'start checkout', text recognition will be performed and checkout will begin
-                if cap:  # If camera 20 is already on, close it first
-                    cap.release()
-                    cv2.destroyAllWindows()
-                ocr_text = recognize_text_from_camera(camera_index=22, timeout=30)
+                pipeline.pause()  # If camera 20 is already on, close it first
+                # A still voucher is only read again when the frame changes
+                ocr_text = recognize_text_from_camera(camera_index=22, timeout=30,
+                                                      gate=SceneChangeGate(pixel_thresh=12, change_ratio=0.01, max_skip=30))
                 if ocr_text:
                     print('结算结果：', ocr_text)
                 else:
                     print("文字识别失败或超时")
                 # After the recognition is completed, reopen the camera 20
-                cap = cv2.VideoCapture(20, cv2.CAP_V4L)
-                if not cap.isOpened():
-                    print("❌ 无法重新打开摄像头20")
+                pipeline.resume()
                 continue  
 
             # Checks if the input category is among the valid categories
             if user_input.lower() not in valid_classes:
                 print(f"无效类别：'{user_input}'，请重新输入有效的类别。")
                 continue
-            cls = user_input.strip()
-            res = grab_an_object_and_place_it_in_a_position(cls, latest_frame, motion_control, detector)
+            cls = user_input.strip().lower()
+            selected_class = pipeline.selected_class = cls
+            res = grab_an_object_and_place_it_in_a_position(cls, pipeline.latest_frame(), motion_control, detector, tracker)
             print(res)
         except Exception as e:
             print("发生错误：", e)
@@ -127,4 +80,5 @@ if __name__ == '__main__':
 
     user_input_loop()  # The main thread waits for user input
 
+    pipeline.stop()
     display_thread.join()
@@ -1,5 +1,5 @@
-import onnxruntime as ort
 import numpy as np
+from spacemit_runtime import get_session
 
 class Tokenizer:
     def __init__(
@@ -7,10 +7,9 @@ class Tokenizer:
             ortext_path,
             decode_model_path
         ):
-        self.so = ort.SessionOptions()
-        self.so.register_custom_ops_library(ortext_path)
-        self.so.intra_op_num_threads = 4
-        self.sess = ort.InferenceSession(decode_model_path, self.so)
+        # The decoder needs the onnxruntime-extensions custom ops, keep it on the CPU
+        self.sess = get_session(decode_model_path, providers=["CPUExecutionProvider"], intra_op_num_threads=4,
+                                custom_ops_libraries=(ortext_path,))
 
     def decode(self,
                input_ids):
@@ -12,11 +12,10 @@ import yaml
 try:
     from onnxruntime import (
         GraphOptimizationLevel,
-        InferenceSession,
-        SessionOptions,
         get_available_providers,
         get_device,
     )
+    from spacemit_runtime import get_session
 except:
     print("please pip3 install onnxruntime")
 import jieba
@@ -149,11 +148,11 @@ class ONNXRuntimeError(Exception):
 class OrtInferSession:
     def __init__(self, model_file, device_id=-1, intra_op_num_threads=2):
         device_id = str(device_id)
-        sess_opt = SessionOptions()
-        sess_opt.intra_op_num_threads = intra_op_num_threads
-        sess_opt.log_severity_level = 4
-        sess_opt.enable_cpu_mem_arena = False
-        sess_opt.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_opt = dict(
+            log_severity_level=4,
+            enable_cpu_mem_arena=False,
+            graph_optimization_level=GraphOptimizationLevel.ORT_ENABLE_ALL,
+        )
 
         cuda_ep = "CUDAExecutionProvider"
         cuda_provider_options = {
@@ -176,18 +175,18 @@ class OrtInferSession:
 
         if Path(optimized_model_file).exists():
             print(f"** 已检测到优化后模型，直接加载: {optimized_model_file}")
-            self.session = InferenceSession(
-                optimized_model_file, sess_options=sess_opt, providers=EP_list
+            self.session = get_session(
+                optimized_model_file, providers=EP_list, intra_op_num_threads=intra_op_num_threads, **sess_opt
             )
         else:
             print(f"** 未检测到优化后模型，加载原始模型并进行优化: {model_file}")
 
-            sess_opt.optimized_model_filepath = optimized_model_file
+            sess_opt["optimized_model_filepath"] = optimized_model_file
 
             self._verify_model(model_file)
 
-            self.session = InferenceSession(
-                model_file, sess_options=sess_opt, providers=EP_list
+            self.session = get_session(
+                model_file, providers=EP_list, intra_op_num_threads=intra_op_num_threads, **sess_opt
             )
 
         if device_id != "-1" and cuda_ep not in self.session.get_providers():
@@ -199,22 +198,26 @@ class OrtInferSession:
                 RuntimeWarning,
             )
 
+        # Looked up once instead of on every call
+        self._input_names = [v.name for v in self.session.get_inputs()]
+        self._output_names = [v.name for v in self.session.get_outputs()]
+
     def __call__(self, input_content: List[Union[np.ndarray, np.ndarray]]) -> np.ndarray:
-        input_dict = dict(zip(self.get_input_names(), input_content))
+        input_dict = dict(zip(self._input_names, input_content))
         try:
-            return self.session.run(self.get_output_names(), input_dict)
+            return self.session.run(self._output_names, input_dict)
         except Exception as e:
             raise ONNXRuntimeError("ONNXRuntime inferece failed.") from e
 
     def get_input_names(
         self,
     ):
-        return [v.name for v in self.session.get_inputs()]
+        return self._input_names
 
     def get_output_names(
         self,
     ):
-        return [v.name for v in self.session.get_outputs()]
+        return self._output_names
 
     def get_character_list(self, key: str = "character"):
         return self.meta_dict[key].splitlines()
@@ -1,4 +1,7 @@
 from .elephant_detection import ElephantDetection
-from .agv_detection import AGVDetection
+from .detections import Detections
+from .pipeline import DetectionPipeline
+from .tracker import ByteTracker
+from .scene_gate import SceneChangeGate
 
-__all__ = ["ElephantDetection", "AGVDetection"]
\ No newline at end of file
+__all__ = ["ElephantDetection", "Detections", "DetectionPipeline", "ByteTracker", "SceneChangeGate"]
\ No newline at end of file
@@ -0,0 +1,446 @@
+"""
+benchmark.py
+Micro-benchmarks for the ElephantDetection pipeline
+
+Usage:
+    python -m spacemit_cv.benchmark nms --boxes 2000 --repeat 200
+    python -m spacemit_cv.benchmark preprocess --image spacemit_cv/test.jpg
+    python -m spacemit_cv.benchmark cold-start
+    python -m spacemit_cv.benchmark latency --models spacemit_cv/yolov8n.q.onnx --inputs spacemit_cv/test.jpg videos/ --json out.json
+    python -m spacemit_cv.benchmark io-binding --models spacemit_cv/yolov8n.q.onnx spacemit_cv/yolov8n.q.nms.onnx
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import cv2
+import numpy as np
+
+import onnxruntime as ort
+from .elephant_detection import ElephantDetection, NMS_METADATA_KEY, batched_nms
+from .detections import Detections
+from .letterbox import Letterbox
+from spacemit_runtime import SessionRegistry, ModelCache
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+LATENCY_STAGES = ('preprocess', 'session', 'postprocess', 'nms', 'draw', 'total')
+
+# Vision models covered by the optimized-model cache, missing ones are skipped
+COLD_START_MODELS = ['spacemit_cv/best.onnx', 'spacemit_cv/yolov8n.q.onnx', 'spacemit_orc/models/ppocr3_det_fixed.onnx',
+                     'spacemit_orc/models/ppocr_rec.onnx', 'spacemit_orc/models/ch_ppocrv2_cls.onnx']
+
+
+def legacy_nms(dets, nms_thresh):
+    """
+    Reference copy of the per-class NMS loop that ElephantDetection.nms used to run
+    :param dets: list of [x1, y1, x2, y2, label, score]
+    :param nms_thresh: IoU threshold
+    :return: list of kept rows
+    """
+    if len(dets) == 0:
+        return np.empty((0, 6))
+
+    dets_array = np.array(dets)
+    unique_labels = np.unique(dets_array[:, 4])
+    final_dets = []
+
+    for label in unique_labels:
+        mask = dets_array[:, 4] == label
+        dets_class = dets_array[mask]
+        order = np.argsort(-dets_class[:, 5])
+        dets_class = dets_class[order]
+
+        keep = []
+        while dets_class.shape[0] > 0:
+            keep.append(dets_class[0])
+            if dets_class.shape[0] == 1:
+                break
+            box, boxes = keep[-1], dets_class[1:]
+            x1 = np.maximum(box[0], boxes[:, 0])
+            y1 = np.maximum(box[1], boxes[:, 1])
+            x2 = np.minimum(box[2], boxes[:, 2])
+            y2 = np.minimum(box[3], boxes[:, 3])
+            inter_area = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+            box_area = (box[2] - box[0]) * (box[3] - box[1])
+            boxes_area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+            ious = inter_area / (box_area + boxes_area - inter_area)
+            dets_class = dets_class[1:][ious < nms_thresh]
+
+        final_dets.extend(keep)
+
+    return final_dets
+
+
+def legacy_preprocess(image, input_size=(320, 320)):
+    """
+    Reference copy of the preprocessing ElephantDetection.infer used to run, including the initial frame copy
+    """
+    image = image.copy()
+    shape = image.shape[:2]
+    r = min(input_size[0] / shape[0], input_size[1] / shape[1])
+    new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+    dw, dh = (input_size[1] - new_unpad[0]) / 2, (input_size[0] - new_unpad[1]) / 2
+    if shape[::-1] != new_unpad:
+        image = cv2.resize(image, new_unpad, interpolation=cv2.INTER_LINEAR)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(0, 0, 0))
+    image = image.astype(np.float32) / 255.0
+    image = np.transpose(image, (2, 0, 1))
+    return np.expand_dims(image, axis=0)
+
+
+def make_shelf_dets(num_boxes, num_objects=20, num_classes=15, image_size=(640, 480), seed=0):
+    """
+    Generate postprocess-like candidates: several jittered anchors around each object on a busy shelf
+    :return: [N, 6] float32 array of (x1, y1, x2, y2, label, score)
+    """
+    rng = np.random.default_rng(seed)
+    w, h = image_size
+    centers = rng.uniform((40, 40), (w - 40, h - 40), size=(num_objects, 2))
+    sizes = rng.uniform(30, 120, size=(num_objects, 2))
+    labels = rng.integers(0, num_classes, size=num_objects)
+
+    owner = rng.integers(0, num_objects, size=num_boxes)
+    c = centers[owner] + rng.normal(0, 6, size=(num_boxes, 2))
+    s = sizes[owner] * rng.uniform(0.85, 1.15, size=(num_boxes, 2))
+    x1y1 = np.maximum(0, c - s / 2).astype(int)
+    x2y2 = np.maximum(0, c + s / 2).astype(int)
+    scores = rng.uniform(0.3, 0.95, size=num_boxes)
+    return np.column_stack((x1y1, x2y2, labels[owner], scores)).astype(np.float32)
+
+
+def _time_it(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000
+
+
+def bench_nms(args):
+    print(f"{'boxes':>6} {'legacy ms':>10} {'batched ms':>11} {'speedup':>8} {'kept':>5} {'same':>5}")
+    for num_boxes in args.boxes:
+        dets = make_shelf_dets(num_boxes, num_objects=args.objects)
+        # The legacy path received a Python list from postprocess
+        dets_list = dets.tolist()
+
+        legacy = legacy_nms(dets_list, args.iou)
+        batched = batched_nms(dets, args.iou, top_k=max(num_boxes, 1), max_det=max(num_boxes, 1))
+        same = sorted(map(tuple, np.asarray(legacy, dtype=np.float32).tolist())) == sorted(map(tuple, batched.tolist()))
+
+        t_legacy = _time_it(lambda: legacy_nms(dets.tolist(), args.iou), args.repeat)
+        t_batched = _time_it(lambda: batched_nms(dets, args.iou), args.repeat)
+        print(f"{num_boxes:>6} {t_legacy:>10.3f} {t_batched:>11.3f} {t_legacy / t_batched:>7.1f}x {len(batched):>5} {str(same):>5}")
+
+
+def _bytes_per_frame(fn, frames):
+    """
+    Peak bytes allocated by fn per frame at steady state, measured with tracemalloc
+    """
+    fn()  # warm up, the first frame may allocate buffers
+    peaks = []
+    tracemalloc.start()
+    for _ in range(frames):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn()
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return int(np.median(peaks))
+
+
+def bench_preprocess(args):
+    image = cv2.imread(args.image)
+    if image is None:
+        raise FileNotFoundError(args.image)
+    input_size = (args.size, args.size)
+    letterbox = Letterbox(input_size)
+
+    diff = np.abs(letterbox([image]) - legacy_preprocess(image, input_size)).max()
+    t_legacy = _time_it(lambda: legacy_preprocess(image, input_size), args.repeat)
+    t_letterbox = _time_it(lambda: letterbox([image]), args.repeat)
+    b_legacy = _bytes_per_frame(lambda: legacy_preprocess(image, input_size), args.frames)
+    b_letterbox = _bytes_per_frame(lambda: letterbox([image]), args.frames)
+
+    print(f"image {image.shape[1]}x{image.shape[0]} -> {args.size}x{args.size}, max abs diff {diff:g}")
+    print(f"{'':>10} {'ms/frame':>9} {'bytes/frame':>12}")
+    print(f"{'legacy':>10} {t_legacy:>9.3f} {b_legacy:>12}")
+    print(f"{'letterbox':>10} {t_letterbox:>9.3f} {b_letterbox:>12}")
+    print(f"letterbox buffers: {letterbox.allocated_bytes} bytes in total, {letterbox.last_frame_bytes} bytes on the last frame")
+
+
+def bench_cold_start(args):
+    models = [m for m in args.models if os.path.exists(m)]
+    if not models:
+        raise FileNotFoundError(', '.join(args.models))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        def load(model_path, use_cache):
+            # A new registry each time, so nothing is shared with the previous load
+            SessionRegistry(cache=ModelCache(cache_dir)).get_session(model_path, use_cache=use_cache)
+
+        print(f"{'model':<28} {'uncached ms':>12} {'first ms':>9} {'cached ms':>10} {'speedup':>8}")
+        for model_path in models:
+            t_plain = _time_it(lambda: load(model_path, False), args.repeat)
+            t_first = _time_it(lambda: load(model_path, True), 1)  # Optimizes and writes the cache entry
+            t_cached = _time_it(lambda: load(model_path, True), args.repeat)
+            print(f"{os.path.basename(model_path):<28} {t_plain:>12.1f} {t_first:>9.1f} {t_cached:>10.1f} {t_plain / t_cached:>7.1f}x")
+
+
+def load_frames(paths, max_frames):
+    """
+    Decode images, image folders and video files into memory, so disk and decode time stay out of the measurement
+    :return: list of (source, frame)
+    """
+    frames = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path))
+            frames += load_frames([f for f in files if f.lower().endswith(IMAGE_EXTENSIONS)], max_frames - len(frames))
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            frame = cv2.imread(path)
+            if frame is None:
+                raise FileNotFoundError(path)
+            frames.append((path, frame))
+        else:
+            cap = cv2.VideoCapture(path)
+            if not cap.isOpened():
+                raise FileNotFoundError(path)
+            while len(frames) < max_frames:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frames.append((path, frame))
+            cap.release()
+        if len(frames) >= max_frames:
+            break
+    return frames[:max_frames]
+
+
+def pad_labels(detector):
+    """
+    Give models trained on more categories than label.txt (e.g. COCO yolov8n) numbered names for the extra ones
+    """
+    if detector.in_graph_nms:
+        metadata = json.loads(detector.infer_session.get_modelmeta().custom_metadata_map.get(NMS_METADATA_KEY, '{}'))
+        num_classes = metadata.get('num_classes')
+    else:
+        num_classes = detector.infer_session.get_outputs()[0].shape[1]
+        num_classes = num_classes - 4 if isinstance(num_classes, int) else None
+    if num_classes and num_classes > len(detector.labels):
+        detector.labels = detector.labels + [str(i) for i in range(len(detector.labels), num_classes)]
+    return detector
+
+
+def _run_stages(detector, frame, timer):
+    # Same steps as ElephantDetection.infer + draw_result, each timed on its own
+    with timer('preprocess'):
+        input_tensor = detector.preprocess([frame])
+    with timer('session'):
+        output = detector.infer_session.run([detector.output_name], {detector.input_name: input_tensor})[0]
+    with timer('postprocess'):
+        geometry = detector.letterbox.geometry(frame.shape[:2])
+        if detector.in_graph_nms:
+            dets = detector.unletterbox(geometry, output)
+        else:
+            dets = detector.postprocess(geometry, output, output.shape[2], output.shape[1], detector.class_conf)
+    with timer('nms'):
+        if not detector.in_graph_nms:
+            dets = detector.nms(dets)
+        detections = Detections.from_array(dets, detector.labels)
+    with timer('draw'):
+        detector.draw_result(frame, detections)
+
+
+class _StageTimer:
+    def __init__(self):
+        self.samples = {stage: [] for stage in LATENCY_STAGES}
+        self._stage = None
+
+    def __call__(self, stage):
+        self._stage = stage
+        return self
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.samples[self._stage].append(time.perf_counter() - self._start)
+
+
+class _StageAllocations(_StageTimer):
+    # Peak bytes allocated inside each stage, tracemalloc must be running
+    def __enter__(self):
+        self._base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def __exit__(self, *exc):
+        self.samples[self._stage].append(tracemalloc.get_traced_memory()[1] - self._base)
+
+
+def bench_model(model_path, frames, repeat, warmup, alloc_frames):
+    """
+    Latency percentiles and allocations of every stage of one model
+    :return: dict with FPS and per-stage p50/p95/p99/mean in ms and peak bytes allocated per frame (Python and NumPy
+             allocations only, onnxruntime's own arena is not visible to tracemalloc)
+    """
+    detector = pad_labels(ElephantDetection(model_path))
+
+    for _ in range(warmup):
+        _run_stages(detector, frames[0][1], _StageTimer())
+
+    timer = _StageTimer()
+    for _ in range(repeat):
+        for _, frame in frames:
+            start = time.perf_counter()
+            _run_stages(detector, frame, timer)
+            timer.samples['total'].append(time.perf_counter() - start)
+
+    allocations = _StageAllocations()
+    tracemalloc.start()
+    for _, frame in frames[:alloc_frames]:
+        _run_stages(detector, frame, allocations)
+        # Sum of the stage peaks: bytes the frame allocates on its way through the pipeline
+        allocations.samples['total'].append(sum(allocations.samples[stage][-1] for stage in LATENCY_STAGES[:-1]))
+    tracemalloc.stop()
+
+    stages = {}
+    for stage in LATENCY_STAGES:
+        ms = np.array(timer.samples[stage]) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        stages[stage] = {'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3), 'p99_ms': round(p99, 3),
+                         'mean_ms': round(ms.mean(), 3), 'bytes_per_frame': int(np.median(allocations.samples[stage]))}
+    total = np.array(timer.samples['total'])
+    return {
+        'model': model_path,
+        'providers': detector.infer_session.get_providers(),
+        'input_size': list(detector.input_size),
+        'frames': len(total),
+        'fps': round(len(total) / total.sum(), 2),
+        'stages': stages,
+    }
+
+
+def bench_latency(args):
+    frames = load_frames(args.inputs, args.max_frames)
+    if not frames:
+        raise FileNotFoundError(', '.join(args.inputs))
+
+    report = {
+        'environment': {'onnxruntime': ort.__version__, 'numpy': np.__version__, 'opencv': cv2.__version__,
+                        'python': platform.python_version(), 'machine': platform.machine(), 'node': platform.node(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'inputs': {'sources': args.inputs, 'frames': len(frames), 'repeat': args.repeat},
+        'results': [bench_model(m, frames, args.repeat, args.warmup, args.alloc_frames) for m in args.models],
+    }
+
+    # Human readable summary on stderr, JSON on stdout or in a file
+    for result in report['results']:
+        print(f"{result['model']}  {result['fps']} FPS  {','.join(result['providers'])}", file=sys.stderr)
+        print(f"{'stage':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'bytes/frame':>12}", file=sys.stderr)
+        for stage, row in result['stages'].items():
+            print(f"{stage:>12} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['bytes_per_frame']:>12}",
+                  file=sys.stderr)
+
+    if args.json == '-':
+        print(json.dumps(report, indent=2))
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def check_io_binding(model_path, frames, repeat):
+    """
+    Run a model with and without IOBinding over the same frames and compare the outputs
+    :param frames: frames in the order they are fed, alternate ones with and without detections to make outputs
+                   whose shape depends on the data (in-graph NMS) change size between runs
+    :return: (number of runs, number of runs whose outputs differ)
+    """
+    detector = ElephantDetection(model_path)
+    registry = SessionRegistry()
+    plain = registry.get_session(model_path, io_binding=False)
+    bound = registry.get_session(model_path, io_binding=True)
+    runs, mismatches = 0, 0
+    for _ in range(repeat):
+        for frame in frames:
+            feed = {detector.input_name: detector.preprocess([frame])}
+            expected = plain.run(None, feed)
+            outputs = bound.run(None, feed)
+            runs += 1
+            mismatches += any(a.shape != b.shape or not np.array_equal(a, b) for a, b in zip(expected, outputs))
+    return runs, mismatches
+
+
+def bench_io_binding(args):
+    frames = [frame for _, frame in load_frames(args.inputs, args.max_frames)]
+    if not frames:
+        raise FileNotFoundError(', '.join(args.inputs))
+    # A blank frame between the real ones gives no detections
+    blank = np.zeros_like(frames[0])
+    frames = [f for frame in frames for f in (blank, frame, frame)]
+
+    failed = False
+    print(f"{'model':<28} {'runs':>6} {'mismatches':>11}")
+    for model_path in args.models:
+        runs, mismatches = check_io_binding(model_path, frames, args.repeat)
+        failed |= mismatches > 0
+        print(f"{os.path.basename(model_path):<28} {runs:>6} {mismatches:>11}")
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ElephantDetection benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    nms_parser = sub.add_parser('nms', help='Compare batched NMS against the legacy per-class loop')
+    nms_parser.add_argument('--boxes', type=int, nargs='+', default=[50, 200, 1000, 3000], help='Number of candidate boxes')
+    nms_parser.add_argument('--objects', type=int, default=20, help='Number of objects on the synthetic shelf')
+    nms_parser.add_argument('--iou', type=float, default=0.45, help='NMS IoU threshold')
+    nms_parser.add_argument('--repeat', type=int, default=100, help='Number of timed runs per size')
+    nms_parser.set_defaults(func=bench_nms)
+
+    pre_parser = sub.add_parser('preprocess', help='Compare the preallocated letterbox against the legacy preprocessing')
+    pre_parser.add_argument('--image', type=str, default='spacemit_cv/test.jpg', help='Path to the input image')
+    pre_parser.add_argument('--size', type=int, default=320, help='Model input size')
+    pre_parser.add_argument('--repeat', type=int, default=200, help='Number of timed runs')
+    pre_parser.add_argument('--frames', type=int, default=50, help='Number of frames traced for allocations')
+    pre_parser.set_defaults(func=bench_preprocess)
+
+    cold_parser = sub.add_parser('cold-start', help='Compare model load time with and without the optimized-model cache')
+    cold_parser.add_argument('--models', type=str, nargs='+', default=COLD_START_MODELS, help='Paths to the ONNX models')
+    cold_parser.add_argument('--repeat', type=int, default=5, help='Number of timed loads per model')
+    cold_parser.set_defaults(func=bench_cold_start)
+
+    lat_parser = sub.add_parser('latency', help='Per-stage latency percentiles, FPS and allocations of detection models')
+    lat_parser.add_argument('--models', type=str, nargs='+', default=['spacemit_cv/yolov8n.q.onnx'], help='Paths to the ONNX models')
+    lat_parser.add_argument('--inputs', type=str, nargs='+', default=['spacemit_cv/test.jpg'], help='Images, image folders or video files')
+    lat_parser.add_argument('--max-frames', type=int, default=300, help='Maximum number of frames loaded from the inputs')
+    lat_parser.add_argument('--repeat', type=int, default=50, help='Number of passes over the frames')
+    lat_parser.add_argument('--warmup', type=int, default=5, help='Untimed runs before measuring')
+    lat_parser.add_argument('--alloc-frames', type=int, default=20, help='Number of frames traced for allocations')
+    lat_parser.add_argument('--json', type=str, default='-', help="Write the JSON report to this file, '-' for stdout")
+    lat_parser.set_defaults(func=bench_latency)
+
+    bind_parser = sub.add_parser('io-binding', help='Check that IOBinding returns the same outputs as a plain session')
+    bind_parser.add_argument('--models', type=str, nargs='+', default=['spacemit_cv/yolov8n.q.onnx'],
+                             help='Paths to the ONNX models, include one exported with in-graph NMS')
+    bind_parser.add_argument('--inputs', type=str, nargs='+', default=['spacemit_cv/test.jpg'], help='Images, image folders or video files')
+    bind_parser.add_argument('--max-frames', type=int, default=20, help='Maximum number of frames loaded from the inputs')
+    bind_parser.add_argument('--repeat', type=int, default=3, help='Number of passes over the frames')
+    bind_parser.set_defaults(func=bench_io_binding)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+detections.py
+Compact detection result backed by a single structured NumPy array.
+Boxes, category indices and scores of a frame live in one contiguous buffer, accessors are vectorized and
+slicing returns views, so no Python object is created per box unless the legacy tuple view is requested.
+"""
+
+import numpy as np
+
+# x1, y1, x2, y2 in original image pixels, category index into labels, confidence
+DETECTION_DTYPE = np.dtype([('box', np.float32, (4,)), ('label', np.int32), ('score', np.float32)])
+
+
+class Detections:
+    def __init__(self, data, labels):
+        """
+        :param data: structured array of DETECTION_DTYPE
+        :param labels: category names indexed by the label field, shared and never copied
+        """
+        self.data = data
+        self.labels = labels
+
+    @classmethod
+    def from_array(cls, dets, labels):
+        """
+        Build from an [N, 6] array of (x1, y1, x2, y2, label, score) rows as produced by batched_nms
+        """
+        dets = np.asarray(dets, dtype=np.float32).reshape(-1, 6)
+        data = np.empty(len(dets), dtype=DETECTION_DTYPE)
+        data['box'] = dets[:, :4]
+        data['label'] = dets[:, 4]
+        data['score'] = dets[:, 5]
+        return cls(data, labels)
+
+    @classmethod
+    def from_rects(cls, rect_list, class_names, labels):
+        """
+        Build from the legacy (rect_list, class_names) pair
+        """
+        dets = [(x1, y1, x1 + w, y1 + h, labels.index(name), score)
+                for ((x1, y1), w, h, _, score), name in zip(rect_list, class_names)]
+        return cls.from_array(dets, labels)
+
+    @classmethod
+    def empty(cls, labels):
+        return cls(np.empty(0, dtype=DETECTION_DTYPE), labels)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __bool__(self):
+        return len(self.data) > 0
+
+    def __getitem__(self, index):
+        """
+        Slices return views of the same buffer, masks and index arrays return copies; an int gives a one-row view
+        """
+        if isinstance(index, (int, np.integer)):
+            i = index + len(self.data) if index < 0 else index
+            if not 0 <= i < len(self.data):
+                raise IndexError(f"detection index {index} out of range for {len(self.data)} boxes")
+            index = slice(i, i + 1)
+        return Detections(self.data[index], self.labels)
+
+    def __repr__(self):
+        return f"Detections({len(self)} boxes: {self.names})"
+
+    @property
+    def boxes(self):
+        """
+        [N, 4] view of (x1, y1, x2, y2)
+        """
+        return self.data['box']
+
+    @property
+    def label_ids(self):
+        return self.data['label']
+
+    @property
+    def scores(self):
+        return self.data['score']
+
+    @property
+    def names(self):
+        return [self.labels[i] for i in self.data['label']]
+
+    @property
+    def centers(self):
+        """
+        [N, 2] box centres (x, y)
+        """
+        boxes = self.data['box']
+        return (boxes[:, :2] + boxes[:, 2:]) / 2
+
+    @property
+    def sizes(self):
+        """
+        [N, 2] box widths and heights
+        """
+        boxes = self.data['box']
+        return boxes[:, 2:] - boxes[:, :2]
+
+    def label_id(self, name):
+        return self.labels.index(name)
+
+    def filter(self, label=None, min_score=None):
+        """
+        Keep the boxes of one or more categories and/or above a score
+        :param label: category name, index or a list of them
+        :param min_score: minimum confidence
+        """
+        mask = np.ones(len(self.data), dtype=bool)
+        if label is not None:
+            if isinstance(label, (str, int, np.integer)):
+                label = [label]
+            # Unknown names simply match nothing
+            ids = [int(l) if not isinstance(l, str) else self.labels.index(l) if l in self.labels else -1 for l in label]
+            mask &= np.isin(self.data['label'], ids)
+        if min_score is not None:
+            mask &= self.data['score'] >= min_score
+        return Detections(self.data[mask], self.labels)
+
+    def top(self, k=1, label=None):
+        """
+        The k highest scoring boxes, optionally of one category
+        """
+        dets = self.filter(label) if label is not None else self
+        if len(dets) <= k:
+            order = np.argsort(-dets.data['score'], kind='stable')
+        else:
+            order = np.argpartition(-dets.data['score'], k)[:k]
+            order = order[np.argsort(-dets.data['score'][order], kind='stable')]
+        return Detections(dets.data[order], self.labels)
+
+    def best(self, label=None):
+        """
+        Centre (x, y) of the highest scoring box, optionally of one category, None if there is none
+        """
+        dets = self.top(1, label)
+        if len(dets) == 0:
+            return None
+        x, y = dets.centers[0]
+        return float(x), float(y)
+
+    @property
+    def rect_list(self):
+        """
+        Legacy view: list of ((x1, y1), width, height, label, prob)
+        """
+        return [((x1, y1), x2 - x1, y2 - y1, label, score)
+                for (x1, y1, x2, y2), label, score in zip(self.data['box'].tolist(), self.data['label'].tolist(), self.data['score'].tolist())]
+
+    @property
+    def class_names(self):
+        """
+        Legacy view: category name of each box
+        """
+        return self.names
+
+    def to_legacy(self):
+        """
+        :return: (rect_list, class_names) as ElephantDetection.infer used to return
+        """
+        return self.rect_list, self.class_names
@@ -1,99 +1,227 @@
+import threading
 import cv2
 import numpy as np
-import onnxruntime as ort
-import spacemit_ort
+from spacemit_runtime import get_session
+from .letterbox import Letterbox
+from .detections import Detections
+
+# Up to this many candidates the full IoU matrix is cheaper than suppressing box by box
+NMS_MATRIX_MAX_BOXES = 128
+# Model metadata written by export_nms: thresholds baked into the graph and the number of categories
+NMS_METADATA_KEY = 'spacemit_nms'
+
+
+def batched_nms(dets, iou_thresh, top_k=1000, max_det=300):
+    """
+    Class-aware NMS over all categories at once
+    :param dets: [N, 6] array of (x1, y1, x2, y2, label, score)
+    :param iou_thresh: boxes of the same category overlapping a kept box by this IoU or more are removed
+    :param top_k: number of highest scoring boxes that take part in NMS
+    :param max_det: maximum number of boxes returned
+    :return: kept rows of dets, sorted by confidence from high to low
+    """
+    if len(dets) == 0:
+        return np.empty((0, 6), dtype=np.float32)
+
+    # Sort by confidence from high to low and keep the top k candidates
+    order = np.argsort(-dets[:, 5], kind='stable')[:top_k]
+    dets = dets[order]
+
+    # Shift each category into its own coordinate range so boxes of different categories never overlap
+    offsets = dets[:, 4] * (dets[:, :4].max() + 1)
+    x1 = dets[:, 0] + offsets
+    y1 = dets[:, 1] + offsets
+    x2 = dets[:, 2] + offsets
+    y2 = dets[:, 3] + offsets
+    areas = (x2 - x1) * (y2 - y1)
+
+    if len(dets) <= NMS_MATRIX_MAX_BOXES:
+        keep = _nms_iou_matrix(x1, y1, x2, y2, areas, iou_thresh)
+    else:
+        keep = _nms_greedy(x1, y1, x2, y2, areas, iou_thresh)
+
+    return dets[keep[:max_det]]
+
+
+def _nms_iou_matrix(x1, y1, x2, y2, areas, iou_thresh):
+    # Pairwise overlaps of all candidates; IoU >= thresh is tested as inter >= thresh * union
+    inter_w = np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :])
+    inter_h = np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :])
+    np.maximum(inter_w, 0, out=inter_w)
+    np.maximum(inter_h, 0, out=inter_h)
+    inter_area = inter_w * inter_h
+    suppress = inter_area >= iou_thresh * (areas[:, None] + areas[None, :] - inter_area)
+
+    # Walk the score order once; only boxes that survive get to suppress lower scoring ones
+    keep = np.ones(len(areas), dtype=bool)
+    for i in range(len(areas)):
+        if keep[i]:
+            keep[i + 1:] &= ~suppress[i, i + 1:]
+    return np.flatnonzero(keep)
+
+
+def _nms_greedy(x1, y1, x2, y2, areas, iou_thresh):
+    keep = []
+    remaining = np.arange(len(areas))
+    while remaining.size > 0:
+        # Keep the detection result with the highest current confidence
+        i = remaining[0]
+        keep.append(i)
+        rest = remaining[1:]
+
+        # Remove boxes whose IoU with the kept box reaches the threshold
+        inter_w = np.maximum(0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        inter_h = np.maximum(0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        inter_area = inter_w * inter_h
+        remaining = rest[inter_area < iou_thresh * (areas[i] + areas[rest] - inter_area)]
+    return np.asarray(keep, dtype=np.intp)
+
+
 class ElephantDetection:
     def __init__(self, model_path="best.onnx"):
         self.model_path = model_path
         self.class_conf = 0.3
         self.nms_thresh = 0.45
+        self.nms_top_k = 1000  # Only the highest scoring candidates take part in NMS
+        self.max_det = 300
         self.labels = [line.strip() for line in open("spacemit_cv/label.txt", 'r').readlines()]
         self.infer_session= self.init_infer_session()
         self.warm_up_times = 1
         self.input_name = self.infer_session.get_inputs()[0].name
         self.output_name = self.infer_session.get_outputs()[0].name
-        self.input_size = self.infer_session.get_inputs()[0].shape[2:4]
+        # Models converted with spacemit_runtime.uint8_input take raw uint8 [N, H, W, 3] BGR frames
+        self.uint8_input = self.infer_session.get_inputs()[0].type == 'tensor(uint8)'
+        input_shape = self.infer_session.get_inputs()[0].shape
+        self.input_size = input_shape[1:3] if self.uint8_input else input_shape[2:4]
+        # Symbolic (str/None) for dynamic-batch exports, an int for fixed-batch ones
+        self.batch_dim = self.infer_session.get_inputs()[0].shape[0]
+        # Models exported with export_nms return final [N, 6] detections instead of the raw (1, 4 + C, anchors) tensor
+        self.in_graph_nms = len(self.infer_session.get_outputs()[0].shape) == 2
+        self.letterbox = Letterbox(self.input_size, uint8=self.uint8_input)
+        # The letterbox buffer is shared, so frames from different threads are preprocessed one at a time
+        self._lock = threading.Lock()
 
 
     def init_infer_session(self):
-        session_options = ort.SessionOptions()
-        session_options.intra_op_num_threads = 4
-
-        # Loading ONNX Model
-        session = ort.InferenceSession(self.model_path,sess_options=session_options, providers=["SpaceMITExecutionProvider"])
-
-        return session
+        # Loading ONNX Model, shared with any other detector using the same model
+        return get_session(self.model_path)
 
     def warm_up(self):
-        warm_up_img = np.random.rand(1,3, self.input_size[0], self.input_size[1]).astype(np.float32)
+        if self.uint8_input:
+            warm_up_img = np.random.randint(0, 256, (1, self.input_size[0], self.input_size[1], 3), dtype=np.uint8)
+        else:
+            warm_up_img = np.random.rand(1,3, self.input_size[0], self.input_size[1]).astype(np.float32)
 
         for i in range(self.warm_up_times):
             self.infer_session.run([self.output_name], {self.input_name: warm_up_img})
 
-    def infer(self,image):
-        img = image.copy()
+    def infer(self,image, target_classes=None):
+        """
+        Detect objects on one frame
+        :param image: BGR frame
+        :param target_classes: optional category names (or indices), only these classes are scored and NMSed
+        :return: Detections
+        """
+        class_ids = self.resolve_classes(target_classes)
+        with self._lock:
+            # Image preprocessing
+            input_tensor = self.preprocess([image])
+            # Making inferences
+            outputs = self.infer_session.run([self.output_name], {self.input_name: input_tensor})
+            # With IOBinding the output buffer is reused by the next run, consume it before releasing the lock
+            return self.build_results(image, outputs[0], class_ids)
+
+    def infer_batch(self, frames, target_classes=None):
+        """
+        Detect objects on several frames (e.g. the arm camera and the checkout camera) with a single session run
+        :param frames: list of BGR images, they may have different resolutions
+        :param target_classes: optional category names (or indices) applied to every frame, see infer
+        :return: list of Detections, one entry per frame in input order
+        """
+        if len(frames) == 0:
+            return []
+
+        # Fixed-batch exports such as best.onnx only take one frame per run
+        if not self.supports_batch(len(frames)):
+            return [self.infer(frame, target_classes) for frame in frames]
+
+        class_ids = self.resolve_classes(target_classes)
+
+        with self._lock:
+            # Letterbox every frame into one [N, 3, H, W] tensor
+            input_tensor = self.preprocess(frames)
+            output = self.infer_session.run([self.output_name], {self.input_name: input_tensor})[0]
+
+            # Split the batch and undo each frame's own letterbox
+            return [self.build_results(frame, output[i:i + 1], class_ids) for i, frame in enumerate(frames)]
+
+    def supports_batch(self, batch_size):
+        """
+        Whether the model can take batch_size frames in one run
+        :param batch_size: number of frames
+        :return: True for dynamic-batch exports or a fixed batch of exactly batch_size
+        """
+        if self.in_graph_nms:
+            # The [N, 6] output does not say which frame a box belongs to
+            return batch_size == 1
+        if isinstance(self.batch_dim, int) and self.batch_dim > 0:
+            return self.batch_dim == batch_size
+        return True
+
+    def resolve_classes(self, target_classes):
+        """
+        Convert category names or indices into a sorted index array
+        :param target_classes: None, a name, an index or a list of them
+        :return: None for all classes, otherwise an int array of class indices
+        """
+        if target_classes is None:
+            return None
+        if isinstance(target_classes, (str, int, np.integer)):
+            target_classes = [target_classes]
+
+        class_ids = set()
+        for cls in target_classes:
+            if isinstance(cls, str):
+                if cls not in self.labels:
+                    raise ValueError(f"Unknown category '{cls}', expected one of {self.labels}")
+                cls = self.labels.index(cls)
+            class_ids.add(int(cls))
+        return np.array(sorted(class_ids), dtype=np.intp)
+
+    def build_results(self, image, output, class_ids=None):
+        """
+        Turn the raw output of one frame into Detections
+        :param image: original frame the output belongs to
+        :param output: model output of this frame, [1, 4 + num_classes, anchors] or [N, 6] for in-graph NMS models
+        :param class_ids: optional class indices from resolve_classes, the other classes are skipped
+        :return: Detections
+        """
+        geometry = self.letterbox.geometry(image.shape[:2])
+        if self.in_graph_nms:
+            # Decode, threshold and NMS already ran in the session
+            return Detections.from_array(self.unletterbox(geometry, output, class_ids), self.labels)
 
-        # Image preprocessing
-        input_tensor = self.preprocess(img,self.input_size)
-        # Making inferences
-        outputs = self.infer_session.run([self.output_name], {self.input_name: input_tensor})
-        output = outputs[0]
         offset = output.shape[1]
         anchors = output.shape[2]
 
         # Post-processing
-        dets = self.postprocess(image, output, anchors, offset, self.class_conf,self.input_size)
+        dets = self.postprocess(geometry, output, anchors, offset, self.class_conf, class_ids)
         dets = self.nms(dets)
-        
-
-        rect_list = self.convert_rect_list(dets)
-        class_ids = [int(det[4]) for det in dets]  # Get the category index of all detected objects
-        class_names = [self.labels[int(id)] for id in class_ids]  # Get Category Name
-        # Plotting Results
-        result_img = self.draw_result(img, dets, self.labels)
-
-        return result_img, rect_list, class_names
-
-    def preprocess(self, image, input_size=(320, 320)):
-        shape = image.shape[:2]
-        pad_color=(0,0,0)
-        # Resize an image
-        # Scale ratio
-        r = min(input_size[0] / shape[0], input_size[1] / shape[1])
-        # Compute padding
-        ratio = r  # width, height ratios
-        new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
-        dw, dh = input_size[1] - new_unpad[0], input_size[0] - new_unpad[1]  # wh padding
-        dw /= 2  # divide padding into 2 sides
-        dh /= 2
-        if shape[::-1] != new_unpad:  # resize
-            image = cv2.resize(image, new_unpad, interpolation=cv2.INTER_LINEAR)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
-        left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
-        image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=pad_color)  # add border
-        
-        # Normalization
-        image = image.astype(np.float32) / 255.0
-        # Adjust dimensions to match model input [batch, channel, height, width]
-        image = np.transpose(image, (2, 0, 1))
-        image = np.expand_dims(image, axis=0)
 
-        return image
-    
-    def postprocess(self,image,output, anchors, offset, conf_threshold,input_size=(320,320)):
-        # Get the height and width of the image
-        shape = image.shape[:2]
-        # Calculate the scaling factor
-        r = min(input_size[0] / shape[0], input_size[1] / shape[1])
-        # Calculate the new unfilled size
-        new_unpad = (int(round(shape[1] * r)), int(round(shape[0] * r)))
-        # Calculate fill volume
-        dw, dh = input_size[1] - new_unpad[0], input_size[0] - new_unpad[1]
-        # Divide the filling equally between the two sides
-        dw /= 2
-        dh /= 2
-        
+        return Detections.from_array(dets, self.labels)
+
+    def preprocess(self, images):
+        """
+        Letterbox frames into the model input buffer
+        :param images: list of BGR frames
+        :return: float32 [N, 3, H, W] tensor (uint8 [N, H, W, 3] for uint8-input models), reused by the next call
+        """
+        return self.letterbox(images)
+
+    def postprocess(self, geometry, output, anchors, offset, conf_threshold, class_ids=None):
+        # Letterbox geometry of the frame: scaling factor and padding per side
+        r, dw, dh = geometry.r, geometry.dw, geometry.dh
+
         # Remove redundant dimensions of output
         output = output.squeeze()
 
@@ -103,12 +231,19 @@ class ElephantDetection:
         box_width = output[2, :anchors]
         box_height = output[3, :anchors]
 
-        # Extract all class probabilities corresponding to each anchor point
-        class_probs = output[4:offset, :anchors]
+        if class_ids is not None and len(class_ids) == 1:
+            # A single target class: its own channel is the score, no argmax needed
+            max_probs = output[4 + class_ids[0], :anchors]
+            max_prob_indices = np.broadcast_to(class_ids[0], (anchors,))
+        else:
+            # Extract the class probabilities corresponding to each anchor point, only the requested rows if given
+            class_probs = output[4:offset, :anchors] if class_ids is None else output[4 + class_ids, :anchors]
 
-        # Find the class index with the highest probability and its probability value under each anchor point
-        max_prob_indices = np.argmax(class_probs, axis=0)
-        max_probs = class_probs[max_prob_indices, np.arange(anchors)]
+            # Find the class index with the highest probability and its probability value under each anchor point
+            max_prob_indices = np.argmax(class_probs, axis=0)
+            max_probs = class_probs[max_prob_indices, np.arange(anchors)]
+            if class_ids is not None:
+                max_prob_indices = class_ids[max_prob_indices]
 
         # Filter out anchor points with confidence below the threshold
         valid_mask = max_probs > conf_threshold
@@ -127,96 +262,53 @@ class ElephantDetection:
         y1 = np.maximum(0, ((valid_center_y - half_height) - dh) / r).astype(int)
         y2 = np.maximum(0, ((valid_center_y + half_height) - dh) / r).astype(int)
 
-        # Combine results
-        objects = np.column_stack((x1, y1, x2, y2, valid_max_prob_indices, valid_max_probs)).tolist()    
-                
+        # Combine results, kept as one [N, 6] array so nms can work on it directly
+        objects = np.stack((x1, y1, x2, y2, valid_max_prob_indices, valid_max_probs), axis=1).astype(np.float32)
+
         return objects
     
-    def nms(self,dets):
-        if len(dets) == 0:
-            return np.empty((0, 6))
-        
-        dets_array = np.array(dets)
-        # Group by category
-        unique_labels = np.unique(dets_array[:, 4])
-        final_dets = []
-
-        for label in unique_labels:
-            # Get the detection result of the current category
-            mask = dets_array[:, 4] == label
-            dets_class = dets_array[mask]
-
-            # Sort by confidence from high to low
-            order = np.argsort(-dets_class[:, 5])
-            dets_class = dets_class[order]
-
-            # Perform NMS one by one
-            keep = []
-            while dets_class.shape[0] > 0:
-                # Keep the detection result with the highest current confidence
-                keep.append(dets_class[0])
-                if dets_class.shape[0] == 1:
-                    break
-
-                # Calculate the current box and other boxes IoU
-                ious = self.calculate_iou(keep[-1], dets_class[1:])
-                # Remove boxes whose IoU is greater than the threshold
-                dets_class = dets_class[1:][ious < self.nms_thresh]
-
-            # Add the results of the current category to the final results
-            final_dets.extend(keep)
-
-        return final_dets
-
-
-    def calculate_iou(self,box, boxes):
+    def unletterbox(self, geometry, dets, class_ids=None):
         """
-        Calculate the IoU between a box and a group of boxes
-        :param box: a single box [x1, y1, x2, y2]
-        :param boxes: a group of boxes [N, 4]
-        :return: IoU value [N]
+        Map the [N, 6] output of an in-graph NMS model from model input to image coordinates
+        :param geometry: letterbox geometry of the frame
+        :param dets: (x1, y1, x2, y2, label, score) rows in letterbox coordinates
+        :param class_ids: optional class indices to keep
+        :return: [N, 6] float32 array in the format of nms
         """
-        # Calculate the intersection area
-        x1 = np.maximum(box[0], boxes[:, 0])
-        y1 = np.maximum(box[1], boxes[:, 1])
-        x2 = np.minimum(box[2], boxes[:, 2])
-        y2 = np.minimum(box[3], boxes[:, 3])
-        inter_area = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
-
-        # Calculate the union area
-        box_area = (box[2] - box[0]) * (box[3] - box[1])
-        boxes_area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
-        union_area = box_area + boxes_area - inter_area
-
-        # Calculate IoU
-        return inter_area / union_area
+        if class_ids is not None:
+            dets = dets[np.isin(dets[:, 4], class_ids)]
+        dets = dets.astype(np.float32)  # A copy, the session output is left untouched
+        boxes = dets[:, :4]
+        boxes[:, 0::2] -= geometry.dw
+        boxes[:, 1::2] -= geometry.dh
+        boxes /= geometry.r
+        # Same clipping and integer pixels as postprocess
+        np.maximum(boxes, 0, out=boxes)
+        np.trunc(boxes, out=boxes)
+        return dets
 
+    def nms(self,dets):
+        return batched_nms(dets, self.nms_thresh, self.nms_top_k, self.max_det)
 
 
     # Visualize the results
-    def draw_result(self,image, dets, class_names, color=(0, 255, 0), thickness=2):
+    def draw_result(self, image, detections, class_names=None, selected_class=None, color=(0, 255, 0), selected_color=(0, 0, 255), thickness=2):
+        """
+        Draw the results returned by infer, only needed when the frame is actually shown
+        :param image: frame the results belong to, it is not modified
+        :param detections: Detections returned by infer, or a legacy rect_list together with class_names
+        :param class_names: category names of a legacy rect_list
+        :param selected_class: boxes of this category are drawn in selected_color
+        :return: a copy of image with the boxes drawn
+        """
+        if class_names is not None:
+            detections = Detections.from_rects(detections, class_names, self.labels)
         image = image.copy()
-        image_h, image_w = image.shape[:2]
-
-        for det in dets:
-            x1, y1, x2, y2, label, score = det
-            x1 = int(x1)
-            y1 = int(y1)
-            x2 = int(x2)
-            y2 = int(y2)
+
+        for (x1, y1, x2, y2), name, score in zip(detections.boxes.astype(int).tolist(), detections.names, detections.scores.tolist()):
+            box_color = selected_color if selected_class and name == selected_class else color
             # Draw the bounding box
-            cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            # print('label:', label)
-            cv2.putText(image, f'{class_names[int(label)]}: {score:.2f}', (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+            cv2.rectangle(image, (x1, y1), (x2, y2), box_color, thickness)
+            cv2.putText(image, f'{name}: {score:.2f}', (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, box_color, 2)
 
         return image
-
-
-    def convert_rect_list(self,original_list):
-        converted_list = []
-        for x1, y1, x2, y2, label, prob in original_list:
-            width = x2 - x1
-            height = y2 - y1
-            new_rect = ((x1, y1), width, height, label, prob)
-            converted_list.append(new_rect)
-        return converted_list
\ No newline at end of file
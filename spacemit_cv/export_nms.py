@@ -0,0 +1,151 @@
+"""
+export_nms.py
+Model surgery: append box decode, score threshold and NonMaxSuppression to an exported YOLOv8 graph,
+so the session returns the final detections as a compact [N, 6] tensor of (x1, y1, x2, y2, label, score)
+in model input (letterbox) coordinates instead of the raw (1, 4 + C, anchors) tensor.
+ElephantDetection detects such models and only undoes the letterbox on their output.
+
+Usage:
+    python -m spacemit_cv.export_nms --model spacemit_cv/yolov8n.q.onnx --output spacemit_cv/yolov8n.q.nms.onnx
+"""
+
+import json
+import argparse
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+from .elephant_detection import NMS_METADATA_KEY
+
+
+class _GraphBuilder:
+    def __init__(self, graph, opset, prefix='nms/'):
+        self.graph = graph
+        self.opset = opset
+        self.prefix = prefix
+        self._count = 0
+
+    def name(self, hint):
+        self._count += 1
+        return f"{self.prefix}{hint}_{self._count}"
+
+    def const(self, value, dtype, hint='const'):
+        name = self.name(hint)
+        self.graph.initializer.append(numpy_helper.from_array(np.asarray(value, dtype=dtype), name))
+        return name
+
+    def node(self, op_type, inputs, hint=None, **attrs):
+        output = self.name(hint or op_type)
+        self.graph.node.append(helper.make_node(op_type, inputs, [output], name=output, **attrs))
+        return output
+
+    def slice(self, data, start, end, axis):
+        return self.node('Slice', [data, self.const([start], np.int64), self.const([end], np.int64), self.const([axis], np.int64)])
+
+    def unsqueeze(self, data, axis):
+        if self.opset >= 13:
+            return self.node('Unsqueeze', [data, self.const([axis], np.int64)])
+        return self.node('Unsqueeze', [data], axes=[axis])
+
+    def reduce_max(self, data, axis):
+        if self.opset >= 18:
+            return self.node('ReduceMax', [data, self.const([axis], np.int64)], keepdims=1)
+        return self.node('ReduceMax', [data], axes=[axis], keepdims=1)
+
+
+def append_nms(model, conf_threshold=0.3, iou_threshold=0.45, max_det=300, max_per_class=100):
+    """
+    Append decode + NMS to a YOLOv8 model in place
+    :param model: onnx.ModelProto with a single (1, 4 + C, anchors) output of (cx, cy, w, h, class scores...)
+    :param conf_threshold: boxes whose best class score is not above this are dropped
+    :param iou_threshold: NMS IoU threshold, applied per category
+    :param max_det: maximum number of boxes returned, highest scores first
+    :param max_per_class: maximum number of boxes NMS keeps per category
+    :return: the model
+    """
+    graph = model.graph
+    if len(graph.output) != 1:
+        raise ValueError(f"Expected a single YOLOv8 output, got {len(graph.output)}")
+    raw = graph.output[0]
+    dims = raw.type.tensor_type.shape.dim
+    if len(dims) != 3:
+        raise ValueError(f"Expected a (1, 4 + C, anchors) output, got rank {len(dims)}")
+
+    opset = next(o.version for o in model.opset_import if o.domain in ('', 'ai.onnx'))
+    if opset < 11:
+        raise ValueError(f"Opset {opset} is too old, at least 11 is needed")
+    g = _GraphBuilder(graph, opset)
+
+    # (1, 4 + C, A) -> (1, A, 4 + C)
+    preds = g.node('Transpose', [raw.name], perm=[0, 2, 1])
+    num_channels = dims[1].dim_value or np.iinfo(np.int64).max
+    center = g.slice(preds, 0, 2, 2)
+    size = g.slice(preds, 2, 4, 2)
+    scores = g.slice(preds, 4, num_channels, 2)
+
+    # Box decode: (cx, cy, w, h) -> (x1, y1, x2, y2)
+    half = g.node('Div', [size, g.const(2, np.float32)])
+    boxes = g.node('Concat', [g.node('Sub', [center, half]), g.node('Add', [center, half])], axis=2)
+
+    # Only the best class of each anchor competes, like the argmax of ElephantDetection.postprocess
+    best = g.reduce_max(scores, 2)
+    is_best = g.node('Cast', [g.node('Equal', [scores, best])], to=TensorProto.FLOAT)
+    scores = g.node('Transpose', [g.node('Mul', [scores, is_best])], perm=[0, 2, 1])  # (1, C, A)
+
+    # NMS per category; score_threshold is inclusive while the Python path keeps scores > conf, nudge it up
+    selected = g.node('NonMaxSuppression', [boxes, scores,
+                                           g.const([max_per_class], np.int64),
+                                           g.const([iou_threshold], np.float32),
+                                           g.const([np.nextafter(np.float32(conf_threshold), np.float32(1))], np.float32)])
+    batch_idx = g.slice(selected, 0, 1, 1)
+    class_idx = g.slice(selected, 1, 2, 1)
+    box_idx = g.slice(selected, 2, 3, 1)
+
+    kept_boxes = g.node('GatherND', [boxes, g.node('Concat', [batch_idx, box_idx], axis=1)])   # (K, 4)
+    kept_scores = g.node('GatherND', [scores, selected])                                        # (K,)
+
+    # Highest scores first, at most max_det boxes
+    count = g.node('Shape', [kept_scores])
+    k = g.node('Min', [count, g.const([max_det], np.int64)])
+    top_scores, top_idx = kept_scores + '_top', kept_scores + '_top_idx'
+    graph.node.append(helper.make_node('TopK', [kept_scores, k], [top_scores, top_idx], name=g.name('TopK'), axis=0))
+
+    top_boxes = g.node('Gather', [kept_boxes, top_idx], axis=0)
+    top_labels = g.node('Cast', [g.node('Gather', [class_idx, top_idx], axis=0)], to=TensorProto.FLOAT)  # (K, 1)
+    dets = g.node('Concat', [top_boxes, top_labels, g.unsqueeze(top_scores, 1)], axis=1, hint='dets')
+
+    graph.node.append(helper.make_node('Identity', [dets], ['dets'], name=g.name('output')))
+    del graph.output[:]
+    graph.output.append(helper.make_tensor_value_info('dets', TensorProto.FLOAT, ['num_dets', 6]))
+
+    helper.set_model_props(model, {**{p.key: p.value for p in model.metadata_props},
+                                   NMS_METADATA_KEY: json.dumps({'conf_threshold': conf_threshold, 'iou_threshold': iou_threshold,
+                                                                 'max_det': max_det, 'max_per_class': max_per_class,
+                                                                 'num_classes': dims[1].dim_value - 4 if dims[1].dim_value else None})})
+    return model
+
+
+def export(model_path, output_path, **kwargs):
+    model = append_nms(onnx.load(model_path), **kwargs)
+    onnx.checker.check_model(model)
+    onnx.save(model, output_path)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Append decode and NMS to a YOLOv8 ONNX model')
+    parser.add_argument('--model', type=str, default='spacemit_cv/yolov8n.q.onnx', help='Path to the YOLOv8 ONNX model')
+    parser.add_argument('--output', type=str, default=None, help='Path of the new model, defaults to <model>.nms.onnx')
+    parser.add_argument('--conf', type=float, default=0.3, help='Score threshold')
+    parser.add_argument('--iou', type=float, default=0.45, help='NMS IoU threshold')
+    parser.add_argument('--max-det', type=int, default=300, help='Maximum number of boxes per image')
+    parser.add_argument('--max-per-class', type=int, default=100, help='Maximum number of boxes per category')
+    args = parser.parse_args()
+
+    output = args.output or args.model.replace('.onnx', '.nms.onnx')
+    export(args.model, output, conf_threshold=args.conf, iou_threshold=args.iou, max_det=args.max_det,
+           max_per_class=args.max_per_class)
+    print(f"Model with in-graph NMS written to {output}")
+
+
+if __name__ == '__main__':
+    main()
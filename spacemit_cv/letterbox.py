@@ -0,0 +1,114 @@
+"""
+letterbox.py
+Letterbox preprocessing for the detection model that writes straight into a reusable NCHW buffer,
+or a uint8 NHWC buffer for models with normalization folded into the graph
+"""
+
+from collections import namedtuple
+import cv2
+import numpy as np
+
+# r: scale ratio, new_unpad: (w, h) after resizing, top/left: padding before the image, dw/dh: padding per side
+LetterboxGeometry = namedtuple('LetterboxGeometry', ['r', 'new_unpad', 'top', 'left', 'dw', 'dh'])
+
+
+class Letterbox:
+    def __init__(self, input_size=(320, 320), uint8=False):
+        """
+        Letterbox preprocessing with cached geometry and preallocated buffers
+        :param input_size: model input (height, width)
+        :param uint8: produce raw uint8 [N, H, W, 3] BGR frames for models converted with spacemit_runtime.uint8_input
+        """
+        self.input_size = (int(input_size[0]), int(input_size[1]))
+        self.uint8 = uint8
+        self._geometry = {}       # (h, w) of the input frame -> LetterboxGeometry
+        self._resize_buffers = {} # (h, w) of the input frame -> uint8 buffer for the resized frame
+        self._batch_buffers = {}  # batch size -> float32 [N, 3, H, W] (or uint8 [N, H, W, 3]) model input
+        self._slot_geometry = {}  # batch size -> geometry last written to each slot
+        self.allocated_bytes = 0  # Total bytes of buffers allocated so far
+        self.last_frame_bytes = 0 # Bytes allocated by the last call, 0 at steady state
+
+    def geometry(self, shape):
+        """
+        Letterbox geometry for a frame resolution, computed once per resolution
+        :param shape: (h, w) of the input frame
+        :return: LetterboxGeometry
+        """
+        shape = (int(shape[0]), int(shape[1]))
+        geometry = self._geometry.get(shape)
+        if geometry is None:
+            input_size = self.input_size
+            # Scale ratio
+            r = min(input_size[0] / shape[0], input_size[1] / shape[1])
+            # Compute padding
+            new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+            dw, dh = input_size[1] - new_unpad[0], input_size[0] - new_unpad[1]  # wh padding
+            dw /= 2  # divide padding into 2 sides
+            dh /= 2
+            top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+            geometry = LetterboxGeometry(r, new_unpad, top, left, dw, dh)
+            self._geometry[shape] = geometry
+        return geometry
+
+    def __call__(self, images):
+        """
+        Letterbox a list of BGR frames into the shared model input buffer
+        :param images: list of BGR uint8 images
+        :return: float32 [N, 3, H, W] RGB tensor in [0, 1] (uint8 [N, H, W, 3] BGR in uint8 mode), overwritten by the next call
+        """
+        self.last_frame_bytes = 0
+        if self.uint8 and len(images) == 1 and images[0].shape[:2] == self.input_size and images[0].flags.c_contiguous:
+            # The frame already has the model resolution, pass the buffer through without a copy
+            return images[0][np.newaxis]
+
+        batch = self._batch_buffer(len(images))
+        slot_geometry = self._slot_geometry[len(images)]
+
+        for i, image in enumerate(images):
+            geometry = self.geometry(image.shape[:2])
+            if slot_geometry[i] != geometry:
+                # The image area moved, clear the old content so the padding stays black
+                batch[i].fill(0)
+                slot_geometry[i] = geometry
+
+            if image.shape[1::-1] != geometry.new_unpad:  # resize
+                image = cv2.resize(image, geometry.new_unpad, dst=self._resize_buffer(image.shape[:2]), interpolation=cv2.INTER_LINEAR)
+
+            w, h = geometry.new_unpad
+            if self.uint8:
+                # Channel order, layout and normalization are handled inside the model
+                np.copyto(batch[i, geometry.top:geometry.top + h, geometry.left:geometry.left + w], image)
+                continue
+
+            # BGR -> RGB and HWC -> CHW while copying inside the padding, then normalize in place
+            target = batch[i, :, geometry.top:geometry.top + h, geometry.left:geometry.left + w]
+            for c in range(3):
+                np.copyto(target[c], image[..., 2 - c])
+            np.divide(target, np.float32(255.0), out=target)
+
+        return batch
+
+    def _batch_buffer(self, batch_size):
+        buffer = self._batch_buffers.get(batch_size)
+        if buffer is None:
+            if self.uint8:
+                buffer = np.zeros((batch_size, self.input_size[0], self.input_size[1], 3), dtype=np.uint8)
+            else:
+                buffer = np.zeros((batch_size, 3, self.input_size[0], self.input_size[1]), dtype=np.float32)
+            self._batch_buffers[batch_size] = buffer
+            self._slot_geometry[batch_size] = [None] * batch_size
+            self._count(buffer)
+        return buffer
+
+    def _resize_buffer(self, shape):
+        buffer = self._resize_buffers.get(shape)
+        if buffer is None:
+            w, h = self.geometry(shape).new_unpad
+            buffer = np.empty((h, w, 3), dtype=np.uint8)
+            self._resize_buffers[shape] = buffer
+            self._count(buffer)
+        return buffer
+
+    def _count(self, buffer):
+        self.allocated_bytes += buffer.nbytes
+        self.last_frame_bytes += buffer.nbytes
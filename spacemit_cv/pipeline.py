@@ -0,0 +1,237 @@
+"""
+pipeline.py
+Threaded capture -> detection -> display pipeline for the robot arm camera.
+Each stage runs on its own thread and hands over only the newest item, so stale frames are dropped instead of queuing up.
+"""
+
+import time
+import queue
+import threading
+import cv2
+from spacemit_runtime.profiling import StageCounter
+from .detections import Detections
+
+
+class DetectionPipeline:
+    def __init__(self, detector, camera_index=20, pause_when=None, show_window=True, window_name="result", queue_size=1,
+                 tracker=None, detect_interval=1, gate=None):
+        """
+        Capture, detection and display on separate threads
+        :param detector: ElephantDetection instance
+        :param camera_index: V4L camera index
+        :param pause_when: callable, the camera is released while it returns True (e.g. motion_control.is_busy)
+        :param show_window: draw the results and show them in a window
+        :param window_name: name of the display window
+        :param queue_size: depth of the bounded queues between stages
+        :param tracker: optional ByteTracker kept up to date with the detections
+        :param detect_interval: with a tracker, run detection on every n-th frame and predict the boxes in between
+        :param gate: optional SceneChangeGate, detection results are reused while the scene does not change
+        """
+        self.detector = detector
+        self.camera_index = camera_index
+        self.pause_when = pause_when
+        self.show_window = show_window
+        self.window_name = window_name
+        self.selected_class = None  # Boxes of this category are drawn in red
+        self.target_classes = None  # Categories detected on the display loop, None for all
+        self.tracker = tracker
+        self.detect_interval = max(1, int(detect_interval))
+        self.predicted = 0  # Frames whose boxes came from the tracker instead of the detector
+        self.gate = gate
+        self._frame_index = 0
+
+        self.frame_queue = queue.Queue(maxsize=queue_size)   # capture -> detection
+        self.result_queue = queue.Queue(maxsize=queue_size)  # detection -> display
+        # infer counts detector runs only, frames the gate reused results for and tracker predictions count on their own
+        self.counters = {'capture': StageCounter(), 'infer': StageCounter(), 'gated': StageCounter(),
+                         'predicted': StageCounter(), 'display': StageCounter()}
+        self.dropped = {'capture': 0, 'infer': 0}  # Stale items replaced by newer ones
+        self.latency = 0.0  # Seconds from frame capture to detection result of the last frame
+
+        self._latest = (None, Detections.empty(detector.labels))  # (frame, detections) of the last detected frame
+        self._latest_frame = None
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._paused = threading.Event()
+        self._released = threading.Event()
+        self._released.set()
+        self._threads = []
+
+    def start(self):
+        if self._running.is_set():
+            return
+        self._running.set()
+        targets = [self._capture_loop, self._infer_loop]
+        if self.show_window:
+            targets.append(self._display_loop)
+        self._threads = [threading.Thread(target=target, daemon=True) for target in targets]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._running.clear()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def is_running(self):
+        return self._running.is_set()
+
+    def pause(self, timeout=2.0):
+        """
+        Release the camera (e.g. before the checkout camera is opened) and wait until it is closed
+        """
+        self._paused.set()
+        return self._released.wait(timeout)
+
+    def resume(self):
+        self._paused.clear()
+
+    def is_paused(self):
+        return self._paused.is_set() or (self.pause_when is not None and self.pause_when())
+
+    def latest_frame(self):
+        """
+        The newest captured frame, None before the first frame
+        """
+        with self._lock:
+            return self._latest_frame
+
+    def latest_results(self):
+        """
+        :return: (frame, detections) of the newest detected frame
+        """
+        with self._lock:
+            return self._latest
+
+    def stats(self):
+        """
+        Per-stage FPS, frame counts, queue depths and dropped frames
+        """
+        return {
+            'fps': {name: round(counter.fps, 2) for name, counter in self.counters.items()},
+            'frames': {name: counter.count for name, counter in self.counters.items()},
+            'queue_depth': {'frame': self.frame_queue.qsize(), 'result': self.result_queue.qsize()},
+            'dropped': dict(self.dropped),
+            'predicted': self.predicted,
+            'gate': self.gate.stats() if self.gate is not None else None,
+            'latency_ms': round(self.latency * 1000, 2),
+        }
+
+    def _put_latest(self, q, item, stage):
+        # Replace whatever is still waiting so the consumer always gets the newest item
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                    self.dropped[stage] += 1
+                except queue.Empty:
+                    pass
+
+    def _capture_loop(self):
+        cap = None
+        while self._running.is_set():
+            # If in the capture phase, close the camera
+            if self.is_paused():
+                if cap:
+                    cap.release()
+                    cap = None
+                    # The arm moves or the scene changes while paused, old tracks and results are no longer valid
+                    if self.tracker is not None:
+                        self.tracker.reset()
+                    if self.gate is not None:
+                        self.gate.force_refresh()
+                self._released.set()
+                time.sleep(0.1)
+                continue
+
+            # If it is not open, open it once
+            if cap is None:
+                self._released.clear()
+                cap = cv2.VideoCapture(self.camera_index, cv2.CAP_V4L)
+                if not cap.isOpened():
+                    print(f"❌ 无法打开摄像头{self.camera_index}")
+                    cap.release()
+                    cap = None
+                    self._released.set()
+                    time.sleep(1)
+                    continue
+
+            ret, frame = cap.read()
+            if not ret:
+                continue
+
+            with self._lock:
+                self._latest_frame = frame
+            self._put_latest(self.frame_queue, (time.perf_counter(), frame), 'capture')
+            self.counters['capture'].tick()
+
+        if cap:
+            cap.release()
+        self._released.set()
+
+    def _infer_loop(self):
+        while self._running.is_set():
+            try:
+                captured_at, frame = self.frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            try:
+                if self.gate is not None and not self.gate.should_process(frame):
+                    # Nothing changed since the last detected frame, reuse its results
+                    _, detections = self.latest_results()
+                    self._publish((frame, detections), captured_at, 'gated')
+                    continue
+
+                self._frame_index += 1
+                if self.tracker is not None and self._frame_index % self.detect_interval:
+                    # Skip detection on this frame and move the tracked boxes forward instead
+                    self.tracker.predict()
+                    detections = self.tracker.results()
+                    self.predicted += 1
+                    self._publish((frame, detections), captured_at, 'predicted')
+                else:
+                    detections = self.detector.infer(frame, target_classes=self.target_classes)
+                    if self.tracker is not None:
+                        self.tracker.update(detections)
+                    self._publish((frame, detections), captured_at, 'infer')
+            except Exception as e:
+                # One bad frame must not stop detection, the next frame is tried again
+                print(f"Detection error: {e}")
+
+    def _publish(self, result, captured_at, stage):
+        with self._lock:
+            self._latest = result
+            self.latency = time.perf_counter() - captured_at
+        self.counters[stage].tick()
+
+        if self.show_window:
+            self._put_latest(self.result_queue, result, 'infer')
+
+    def _display_loop(self):
+        window_open = False
+        while self._running.is_set():
+            try:
+                frame, detections = self.result_queue.get(timeout=0.1)
+            except queue.Empty:
+                if window_open and self.is_paused():
+                    cv2.destroyAllWindows()
+                    window_open = False
+                continue
+
+            result_image = self.detector.draw_result(frame, detections, selected_class=self.selected_class)
+            cv2.imshow(self.window_name, result_image)
+            window_open = True
+            self.counters['display'].tick()
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                self._running.clear()
+
+        cv2.destroyAllWindows()
@@ -0,0 +1,206 @@
+"""
+quantize.py
+Offline INT8 quantization of a custom-trained detection model (e.g. best.onnx).
+Calibrates on a local image folder with ONNX Runtime static quantization (QDQ, per-channel weights), then compares the
+quantized model against the float model through the ElephantDetection postprocess. Runs on a CPU-only Linux machine.
+
+Usage:
+    python -m spacemit_cv.quantize --model spacemit_cv/best.onnx --calib-dir calib_images/ --output spacemit_cv/best.q.onnx
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import cv2
+import numpy as np
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                      quant_pre_process, quantize_static)
+
+from .elephant_detection import ElephantDetection
+from .letterbox import Letterbox
+from .benchmark import IMAGE_EXTENSIONS, pad_labels
+from spacemit_runtime import get_session
+
+CALIBRATION_METHODS = {'minmax': CalibrationMethod.MinMax, 'entropy': CalibrationMethod.Entropy,
+                       'percentile': CalibrationMethod.Percentile}
+
+
+def list_images(folder, max_images=None):
+    images = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if not images:
+        raise FileNotFoundError(f"No images in {folder}")
+    return images[:max_images]
+
+
+class LetterboxCalibrationReader(CalibrationDataReader):
+    def __init__(self, image_paths, input_name, input_size):
+        """
+        Feeds calibration images through the same letterbox preprocessing ElephantDetection uses
+        :param image_paths: calibration images
+        :param input_name: model input name
+        :param input_size: model input (h, w)
+        """
+        self.image_paths = image_paths
+        self.input_name = input_name
+        self.letterbox = Letterbox(input_size)
+        self._index = 0
+
+    def get_next(self):
+        while self._index < len(self.image_paths):
+            image = cv2.imread(self.image_paths[self._index])
+            self._index += 1
+            if image is not None:
+                # The letterbox buffer is reused, hand out a copy
+                return {self.input_name: self.letterbox([image]).copy()}
+        return None
+
+    def rewind(self):
+        self._index = 0
+
+
+def quantize_model(model_path, output_path, calib_images, method='minmax', per_channel=True, nodes_to_exclude=None,
+                   preprocess=True):
+    """
+    Static INT8 quantization in QDQ format: uint8 activations, per-channel symmetric int8 weights
+    :param model_path: float ONNX model
+    :param output_path: where the quantized model is written
+    :param calib_images: list of calibration image paths
+    :param method: calibration method, one of CALIBRATION_METHODS
+    :param per_channel: quantize weights per output channel
+    :param nodes_to_exclude: node names kept in float, e.g. the final box decode
+    :param preprocess: run shape inference and graph optimization before quantizing, as onnxruntime recommends
+    """
+    session = get_session(model_path, providers=['CPUExecutionProvider'], use_cache=False)
+    model_input = session.get_inputs()[0]
+    reader = LetterboxCalibrationReader(calib_images, model_input.name, model_input.shape[2:4])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = model_path
+        if preprocess:
+            source = os.path.join(tmp_dir, 'preprocessed.onnx')
+            # ONNX shape inference is enough for the fixed-size YOLOv8 exports and avoids the sympy dependency
+            quant_pre_process(model_path, source, skip_symbolic_shape=True)
+
+        quantize_static(source, output_path, reader,
+                        quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8,
+                        per_channel=per_channel,
+                        calibrate_method=CALIBRATION_METHODS[method],
+                        nodes_to_exclude=nodes_to_exclude or [],
+                        extra_options={'WeightSymmetric': True})
+    return output_path
+
+
+def _match(reference, candidate, iou_thresh):
+    """
+    Greedy same-category matching of two Detections by IoU
+    :return: list of (reference index, candidate index, IoU)
+    """
+    if len(reference) == 0 or len(candidate) == 0:
+        return []
+    a, b = reference.boxes, candidate.boxes
+    inter_w = np.maximum(0, np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]))
+    inter_h = np.maximum(0, np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]))
+    inter = inter_w * inter_h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    ious = inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+    ious[reference.label_ids[:, None] != candidate.label_ids[None, :]] = 0
+
+    matches = []
+    for flat in np.argsort(-ious, axis=None):
+        i, j = divmod(int(flat), ious.shape[1])
+        if ious[i, j] < iou_thresh:
+            break
+        if all(i != m[0] and j != m[1] for m in matches):
+            matches.append((i, j, float(ious[i, j])))
+    return matches
+
+
+def compare_models(float_path, quant_path, image_paths, iou_thresh=0.5, repeat=3):
+    """
+    Accuracy of the quantized model measured against the float model's detections, plus latency of both
+    :return: dict with precision/recall/F1 of the quantized detections, mean IoU and score drift of matched boxes,
+             and median session / end-to-end latency per frame of each model
+    """
+    detectors = {'float': pad_labels(ElephantDetection(float_path)), 'int8': pad_labels(ElephantDetection(quant_path))}
+    images = [image for image in (cv2.imread(p) for p in image_paths) if image is not None]
+
+    results = {name: [d.infer(image) for image in images] for name, d in detectors.items()}
+    matched = reference_total = candidate_total = 0
+    ious, score_drift = [], []
+    for reference, candidate in zip(results['float'], results['int8']):
+        matches = _match(reference, candidate, iou_thresh)
+        matched += len(matches)
+        reference_total += len(reference)
+        candidate_total += len(candidate)
+        ious += [m[2] for m in matches]
+        score_drift += [abs(float(reference.scores[i]) - float(candidate.scores[j])) for i, j, _ in matches]
+
+    precision = matched / candidate_total if candidate_total else 1.0
+    recall = matched / reference_total if reference_total else 1.0
+    report = {
+        'images': len(images),
+        'float_boxes': reference_total,
+        'int8_boxes': candidate_total,
+        'precision': round(precision, 4),
+        'recall': round(recall, 4),
+        'f1': round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0,
+        'mean_iou': round(float(np.mean(ious)), 4) if ious else None,
+        'mean_score_drift': round(float(np.mean(score_drift)), 4) if score_drift else None,
+        'latency_ms': {},
+        'size_mb': {name: round(os.path.getsize(path) / 2 ** 20, 2) for name, path in (('float', float_path), ('int8', quant_path))},
+    }
+
+    for name, detector in detectors.items():
+        session_times, total_times = [], []
+        for _ in range(repeat):
+            for image in images:
+                start = time.perf_counter()
+                input_tensor = detector.preprocess([image])
+                run_start = time.perf_counter()
+                output = detector.infer_session.run([detector.output_name], {detector.input_name: input_tensor})[0]
+                session_times.append(time.perf_counter() - run_start)
+                detector.build_results(image, output)
+                total_times.append(time.perf_counter() - start)
+        report['latency_ms'][name] = {'session': round(float(np.median(session_times)) * 1000, 3),
+                                      'total': round(float(np.median(total_times)) * 1000, 3)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantize a detection model to INT8 and compare it against the float model')
+    parser.add_argument('--model', type=str, default='spacemit_cv/best.onnx', help='Path to the float ONNX model')
+    parser.add_argument('--calib-dir', type=str, required=True, help='Folder with calibration images')
+    parser.add_argument('--eval-dir', type=str, default=None, help='Folder with evaluation images, defaults to the calibration folder')
+    parser.add_argument('--output', type=str, default=None, help='Path of the quantized model, defaults to <model>.q.onnx')
+    parser.add_argument('--max-images', type=int, default=200, help='Maximum number of calibration / evaluation images')
+    parser.add_argument('--method', type=str, default='minmax', choices=sorted(CALIBRATION_METHODS), help='Calibration method')
+    parser.add_argument('--per-tensor', action='store_true', help='Quantize weights per tensor instead of per channel')
+    parser.add_argument('--exclude-nodes', type=str, nargs='*', default=[], help='Node names kept in float')
+    parser.add_argument('--no-preprocess', action='store_true', help='Skip shape inference / optimization before quantizing')
+    parser.add_argument('--iou', type=float, default=0.5, help='IoU for a quantized box to match a float box')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed passes over the evaluation images')
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.model)[0] + '.q.onnx'
+    calib_images = list_images(args.calib_dir, args.max_images)
+    print(f"Calibrating on {len(calib_images)} images ({args.method})")
+    quantize_model(args.model, output, calib_images, method=args.method, per_channel=not args.per_tensor,
+                   nodes_to_exclude=args.exclude_nodes, preprocess=not args.no_preprocess)
+    print(f"Quantized model written to {output}")
+
+    eval_images = list_images(args.eval_dir, args.max_images) if args.eval_dir else calib_images
+    report = compare_models(args.model, output, eval_images, args.iou, args.repeat)
+    print(f"{'':>6} {'session ms':>11} {'total ms':>9} {'size MB':>8}")
+    for name in ('float', 'int8'):
+        latency = report['latency_ms'][name]
+        print(f"{name:>6} {latency['session']:>11.3f} {latency['total']:>9.3f} {report['size_mb'][name]:>8.2f}")
+    print(f"boxes float/int8: {report['float_boxes']}/{report['int8_boxes']}  precision {report['precision']}  "
+          f"recall {report['recall']}  F1 {report['f1']}  mean IoU {report['mean_iou']}  score drift {report['mean_score_drift']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+scene_gate.py
+Cheap scene-change gate: compares a downscaled grayscale copy of each frame against the last processed frame,
+so expensive models only run when the scene actually changed.
+"""
+
+import threading
+import cv2
+import numpy as np
+
+
+class SceneChangeGate:
+    def __init__(self, size=(64, 48), pixel_thresh=12, change_ratio=0.01, max_skip=30):
+        """
+        Frame differencing gate
+        :param size: (w, h) of the downscaled grayscale frame that is compared
+        :param pixel_thresh: absolute gray level difference for a pixel to count as changed
+        :param change_ratio: fraction of changed pixels that counts as a scene change
+        :param max_skip: process a frame anyway after this many skipped frames, 0 to never force
+        """
+        self.size = (int(size[0]), int(size[1]))
+        self.pixel_thresh = pixel_thresh
+        self.change_ratio = change_ratio
+        self.max_skip = max_skip
+
+        self._small = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        self._gray = np.empty((self.size[1], self.size[0]), dtype=np.uint8)
+        self._diff = np.empty_like(self._gray)
+        self._reference = None  # Downscaled gray copy of the last processed frame
+        self._force = True
+        self._skipped = 0
+        self._lock = threading.Lock()
+
+        self.frames = 0   # Frames checked
+        self.hits = 0     # Frames skipped, previous results reused
+        self.forced = 0   # Frames processed because of force_refresh or max_skip
+        self.last_change = 0.0  # Changed pixel fraction of the last checked frame
+
+    def should_process(self, frame):
+        """
+        Whether the frame differs enough from the last processed one
+        :param frame: BGR or gray image
+        :return: True to run the model on this frame, False to reuse the previous results
+        """
+        with self._lock:
+            self.frames += 1
+            if frame.ndim == 3:
+                cv2.resize(frame, self.size, dst=self._small, interpolation=cv2.INTER_AREA)
+                cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            else:
+                cv2.resize(frame, self.size, dst=self._gray, interpolation=cv2.INTER_AREA)
+
+            if self._reference is None or self._force:
+                self.forced += 1
+                return self._accept()
+
+            cv2.absdiff(self._gray, self._reference, dst=self._diff)
+            self.last_change = float(np.count_nonzero(self._diff > self.pixel_thresh)) / self._diff.size
+            if self.last_change >= self.change_ratio:
+                return self._accept()
+
+            if self.max_skip and self._skipped >= self.max_skip:
+                self.forced += 1
+                return self._accept()
+
+            self._skipped += 1
+            self.hits += 1
+            return False
+
+    def force_refresh(self):
+        """
+        Process the next frame regardless of the difference, e.g. after the arm moved
+        """
+        with self._lock:
+            self._force = True
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.frames if self.frames else 0.0
+
+    def stats(self):
+        return {'frames': self.frames, 'hits': self.hits, 'forced': self.forced,
+                'hit_rate': round(self.hit_rate, 3), 'last_change': round(self.last_change, 4)}
+
+    def _accept(self):
+        if self._reference is None:
+            self._reference = self._gray.copy()
+        else:
+            self._reference[...] = self._gray
+        self._force = False
+        self._skipped = 0
+        return True
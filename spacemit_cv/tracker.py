@@ -0,0 +1,288 @@
+"""
+tracker.py
+ByteTrack-style multi-object tracker for ElephantDetection results.
+Keeps stable track IDs and Kalman-smoothed box centres, and a per-category table of the best live track
+so the grab path can look up its target without running another inference.
+"""
+
+import threading
+import numpy as np
+from .detections import Detections
+
+try:
+    import lap
+except ImportError:
+    lap = None
+
+try:
+    from cython_bbox import bbox_overlaps
+except ImportError:
+    bbox_overlaps = None
+
+
+class KalmanFilter:
+    """
+    Constant velocity Kalman filter in (center x, center y, aspect ratio, height) space
+    """
+    def __init__(self):
+        ndim = 4
+        self._motion_mat = np.eye(2 * ndim)
+        for i in range(ndim):
+            self._motion_mat[i, ndim + i] = 1.0
+        self._update_mat = np.eye(ndim, 2 * ndim)
+        self._std_weight_position = 1.0 / 20
+        self._std_weight_velocity = 1.0 / 160
+
+    def initiate(self, measurement):
+        mean = np.r_[measurement, np.zeros(4)]
+        h = measurement[3]
+        std = [2 * self._std_weight_position * h, 2 * self._std_weight_position * h, 1e-2, 2 * self._std_weight_position * h,
+               10 * self._std_weight_velocity * h, 10 * self._std_weight_velocity * h, 1e-5, 10 * self._std_weight_velocity * h]
+        return mean, np.diag(np.square(std))
+
+    def predict(self, mean, covariance):
+        h = mean[3]
+        std = [self._std_weight_position * h, self._std_weight_position * h, 1e-2, self._std_weight_position * h,
+               self._std_weight_velocity * h, self._std_weight_velocity * h, 1e-5, self._std_weight_velocity * h]
+        mean = self._motion_mat @ mean
+        covariance = self._motion_mat @ covariance @ self._motion_mat.T + np.diag(np.square(std))
+        return mean, covariance
+
+    def update(self, mean, covariance, measurement):
+        h = mean[3]
+        std = [self._std_weight_position * h, self._std_weight_position * h, 1e-1, self._std_weight_position * h]
+        projected_mean = self._update_mat @ mean
+        projected_cov = self._update_mat @ covariance @ self._update_mat.T + np.diag(np.square(std))
+
+        kalman_gain = np.linalg.solve(projected_cov, (covariance @ self._update_mat.T).T).T
+        mean = mean + (measurement - projected_mean) @ kalman_gain.T
+        covariance = covariance - kalman_gain @ projected_cov @ kalman_gain.T
+        return mean, covariance
+
+
+class Track:
+    Tracked, Lost, Removed = 0, 1, 2
+
+    def __init__(self, track_id, tlbr, label, label_id, score, kalman_filter, frame_id):
+        self.track_id = track_id
+        self.label = label
+        self.label_id = label_id
+        self.score = score
+        self.state = Track.Tracked
+        self.start_frame = frame_id
+        self.frame_id = frame_id
+        self.hits = 1
+        self._kf = kalman_filter
+        self.mean, self.covariance = kalman_filter.initiate(_tlbr_to_xyah(tlbr))
+
+    def predict(self):
+        if self.state != Track.Tracked:
+            self.mean[7] = 0  # A lost track does not keep growing
+        self.mean, self.covariance = self._kf.predict(self.mean, self.covariance)
+
+    def update(self, tlbr, score, frame_id):
+        self.mean, self.covariance = self._kf.update(self.mean, self.covariance, _tlbr_to_xyah(tlbr))
+        self.score = score
+        self.state = Track.Tracked
+        self.frame_id = frame_id
+        self.hits += 1
+
+    @property
+    def center(self):
+        """
+        Kalman-smoothed box centre (x, y)
+        """
+        return float(self.mean[0]), float(self.mean[1])
+
+    @property
+    def tlbr(self):
+        x, y, a, h = self.mean[:4]
+        w = a * h
+        return np.array([x - w / 2, y - h / 2, x + w / 2, y + h / 2])
+
+    def to_rect(self):
+        """
+        The track in the rect_list format of ElephantDetection: ((x1, y1), width, height, label, prob)
+        """
+        x1, y1, x2, y2 = self.tlbr
+        return (x1, y1), x2 - x1, y2 - y1, self.label, self.score
+
+
+class ByteTracker:
+    def __init__(self, track_thresh=0.5, match_thresh=0.8, low_thresh=0.1, track_buffer=30, min_hits=2):
+        """
+        ByteTrack association: high score boxes first, then low score boxes to keep tracks alive through occlusion
+        :param track_thresh: detections above this score are matched first and can start new tracks
+        :param match_thresh: maximum IoU distance (1 - IoU) for a match
+        :param low_thresh: detections below this score are ignored
+        :param track_buffer: number of frames a lost track is kept before it is removed
+        :param min_hits: matched detections needed before a track is reported
+        """
+        self.track_thresh = track_thresh
+        self.match_thresh = match_thresh
+        self.low_thresh = low_thresh
+        self.track_buffer = track_buffer
+        self.min_hits = min_hits
+        self.kalman_filter = KalmanFilter()
+        self.labels = []  # Category names of the last Detections, used to build results()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all tracks, e.g. after the camera moved
+        """
+        with self._lock:
+            self.frame_id = 0
+            self._next_id = 1
+            self.tracks = []           # Tracked and lost tracks
+            self.best_by_label = {}    # category name -> highest scoring confirmed track
+
+    def update(self, detections):
+        """
+        Associate the detections of a new frame with the existing tracks
+        :param detections: Detections returned by ElephantDetection.infer
+        :return: confirmed tracks of this frame
+        """
+        tlbrs = detections.boxes.astype(np.float64)
+        scores = detections.scores.astype(np.float64)
+        label_ids = detections.label_ids
+
+        with self._lock:
+            self.labels = detections.labels
+            self.frame_id += 1
+            for track in self.tracks:
+                track.predict()
+
+            high = np.flatnonzero(scores >= self.track_thresh)
+            low = np.flatnonzero((scores >= self.low_thresh) & (scores < self.track_thresh))
+
+            # First association: high score detections against every track
+            unmatched_tracks, unmatched_high = self._associate(self.tracks, high, tlbrs, scores, label_ids, self.match_thresh)
+
+            # Second association: low score detections against the tracks still tracked
+            remaining = [t for t in unmatched_tracks if t.state == Track.Tracked]
+            still_unmatched, _ = self._associate(remaining, low, tlbrs, scores, label_ids, 0.5)
+
+            for track in still_unmatched:
+                track.state = Track.Lost
+            for track in unmatched_tracks:
+                if track.state != Track.Tracked and self.frame_id - track.frame_id > self.track_buffer:
+                    track.state = Track.Removed
+
+            # Unmatched high score detections start new tracks
+            for i in unmatched_high:
+                label_id = int(label_ids[i])
+                self.tracks.append(Track(self._next_id, tlbrs[i], self.labels[label_id], label_id, scores[i],
+                                         self.kalman_filter, self.frame_id))
+                self._next_id += 1
+
+            self.tracks = [t for t in self.tracks if t.state != Track.Removed]
+            return self._refresh_table()
+
+    def predict(self):
+        """
+        Advance all tracks to the next frame without a detection, used on frames where detection is skipped
+        :return: confirmed tracks with their predicted boxes
+        """
+        with self._lock:
+            self.frame_id += 1
+            for track in self.tracks:
+                track.predict()
+            return self._refresh_table()
+
+    def find(self, label):
+        """
+        Highest scoring confirmed track of a category, an O(1) lookup in the live track table
+        :param label: category name
+        :return: Track or None
+        """
+        with self._lock:
+            return self.best_by_label.get(label)
+
+    def results(self):
+        """
+        Confirmed tracks as Detections, in the format of ElephantDetection.infer
+        """
+        with self._lock:
+            tracks = self._confirmed()
+            dets = np.array([(*t.tlbr, t.label_id, t.score) for t in tracks], dtype=np.float32).reshape(-1, 6)
+            return Detections.from_array(dets, self.labels)
+
+    def _confirmed(self):
+        return [t for t in self.tracks if t.state == Track.Tracked and t.hits >= self.min_hits]
+
+    def _refresh_table(self):
+        confirmed = self._confirmed()
+        table = {}
+        for track in confirmed:
+            best = table.get(track.label)
+            if best is None or track.score > best.score:
+                table[track.label] = track
+        self.best_by_label = table
+        return confirmed
+
+    def _associate(self, tracks, det_indices, tlbrs, scores, label_ids, thresh):
+        """
+        Match tracks and detections of the same category by IoU
+        :return: unmatched tracks, unmatched detection indices
+        """
+        if len(tracks) == 0 or len(det_indices) == 0:
+            return list(tracks), list(det_indices)
+
+        ious = _iou(np.array([t.tlbr for t in tracks]), tlbrs[det_indices])
+        same_label = np.array([t.label_id for t in tracks])[:, None] == label_ids[det_indices][None, :]
+        cost = np.where(same_label, 1 - ious, 1.0)
+        matches = _linear_assignment(cost, thresh)
+
+        matched_tracks, matched_dets = set(), set()
+        for ti, di in matches:
+            i = det_indices[di]
+            tracks[ti].update(tlbrs[i], scores[i], self.frame_id)
+            matched_tracks.add(ti)
+            matched_dets.add(di)
+
+        unmatched_tracks = [t for ti, t in enumerate(tracks) if ti not in matched_tracks]
+        unmatched_dets = [i for di, i in enumerate(det_indices) if di not in matched_dets]
+        return unmatched_tracks, unmatched_dets
+
+
+def _tlbr_to_xyah(tlbr):
+    x1, y1, x2, y2 = tlbr
+    w, h = x2 - x1, max(y2 - y1, 1e-6)
+    return np.array([x1 + w / 2, y1 + h / 2, w / h, h])
+
+
+def _iou(a, b):
+    if bbox_overlaps is not None:
+        return bbox_overlaps(np.ascontiguousarray(a, dtype=np.float64), np.ascontiguousarray(b, dtype=np.float64))
+    # Same +1 pixel convention as cython_bbox
+    inter_w = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]) + 1
+    inter_h = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]) + 1
+    inter = np.maximum(inter_w, 0) * np.maximum(inter_h, 0)
+    area_a = (a[:, 2] - a[:, 0] + 1) * (a[:, 3] - a[:, 1] + 1)
+    area_b = (b[:, 2] - b[:, 0] + 1) * (b[:, 3] - b[:, 1] + 1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter)
+
+
+def _linear_assignment(cost, thresh):
+    """
+    Minimum cost matching, pairs with a cost above thresh are never matched
+    :return: list of (row, col)
+    """
+    if lap is not None:
+        _, x, _ = lap.lapjv(cost, extend_cost=True, cost_limit=thresh)
+        return [(row, col) for row, col in enumerate(x) if col >= 0]
+
+    # Greedy fallback when lap is not installed
+    matches = []
+    used_rows, used_cols = set(), set()
+    for flat in np.argsort(cost, axis=None):
+        row, col = divmod(int(flat), cost.shape[1])
+        if cost[row, col] > thresh:
+            break
+        if row not in used_rows and col not in used_cols:
+            matches.append((row, col))
+            used_rows.add(row)
+            used_cols.add(col)
+    return matches
@@ -8,24 +8,49 @@ Date: 2025-04-18
 
 import cv2
 import time
+import queue
 import os
 from spacemit_orc.ocr import OCRProcessor
+from spacemit_orc.pipeline import OCRPipeline
+from spacemit_orc.coarse_fine import CoarseToFineOCR
 import sys
 sys.path.append('/home/er/jobot-ai-elephant')
 from spacemit_audio import play_wav_non_blocking, play_wav
 
 class CameraOCR:
-    def __init__(self, camera_index=22, timeout=30):
+    def __init__(self, camera_index=22, timeout=30, gate=None, pipelined=False, coarse_to_fine=False, rec_cache_size=0,
+                 fast_postprocess=False, score_mode='poly'):
+        """
+        :param camera_index: index of the camera filming the vouchers
+        :param timeout: seconds recognize_once keeps reading frames
+        :param gate: optional spacemit_cv.SceneChangeGate, OCR only runs again when the frame changed and the
+                     previous results are reused otherwise
+        :param pipelined: overlap text detection of a frame with text recognition of the previous one on two threads,
+                          results arrive one frame later
+        :param coarse_to_fine: find the voucher on a downscaled frame and read only that region at full resolution,
+                               see CoarseToFineOCR (not combined with pipelined)
+        :param rec_cache_size: number of voucher lines kept in the recognition cache, 0 (default) reads every line
+        :param fast_postprocess: use the fast text detector post-processing, see TextDetector
+        :param score_mode: box score of the fast post-processing, 'poly' or 'box'
+        """
 
         det_model_path = 'spacemit_orc/models/ppocr3_det_fixed.onnx'
         rec_model_path = 'spacemit_orc/models/ppocr_rec.onnx'
         rec_dict_path = 'spacemit_orc/models/rec_word_dict.txt'
-        self.ocr = OCRProcessor(det_model_path, rec_model_path, rec_dict_path)
+        self.ocr = OCRProcessor(det_model_path, rec_model_path, rec_dict_path, rec_cache_size=rec_cache_size,
+                                fast_postprocess=fast_postprocess, score_mode=score_mode)
         self.cap = cv2.VideoCapture(camera_index, cv2.CAP_V4L)
         self.timeout = timeout
         self.start_time = time.time()
         self.recognized_texts = []  # Used to save the recognized text
         self.printed_texts = set()
+        self.gate = gate
+        self.ocr_frames = 0  # Frames OCR actually ran on
+        self._last_results = []
+        self.pipeline = OCRPipeline(self.ocr) if pipelined else None
+        self.coarse_to_fine = CoarseToFineOCR(self.ocr) if coarse_to_fine and not pipelined else None
+        if self.pipeline is not None:
+            self.pipeline.start()
 
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
@@ -43,17 +68,31 @@ class CameraOCR:
                 print("无法获取摄像头画面")
                 break
 
-            # Save temporary frames and identify them
-            temp_path = "temp_frame.jpg"
-            cv2.imwrite(temp_path, frame)
-            try:
-                start_time = time.time()
-                results = self.ocr(temp_path)
-                end_time = (time.time() - start_time) * 1000
-                # print(f"处理时间: {end_time:.3f}ms")
-            except Exception as e:
-                print(f"OCR processing error: {e}")
-                results = []
+            if self.pipeline is not None:
+                # While the pipeline is full the frame is only displayed, the gate keeps the last submitted frame as reference
+                if not self.pipeline.input_queue.full() and (self.gate is None or self.gate.should_process(frame)):
+                    # The queue can fill up between the check and the submit
+                    if self.pipeline.submit(frame, block=False):
+                        self.ocr_frames += 1
+                    elif self.gate is not None:
+                        # The gate took this frame as its reference, make it pass the next one instead
+                        self.gate.force_refresh()
+                results = self._collect_pipeline()
+            elif self.gate is not None and not self.gate.should_process(frame):
+                # The voucher has not moved, the last results still hold
+                results = self._last_results
+            else:
+                # The frame goes to OCR directly, no temporary file
+                try:
+                    start_time = time.time()
+                    results = (self.coarse_to_fine or self.ocr)(frame)
+                    end_time = (time.time() - start_time) * 1000
+                    # print(f"处理时间: {end_time:.3f}ms")
+                except Exception as e:
+                    print(f"OCR processing error: {e}")
+                    results = []
+                self.ocr_frames += 1
+                self._last_results = results
             valid_texts = ["超市抵用券1元", "超市抵用券2元", "超市抵用券5元", "超市抵用券10元", "超市抵用券20元"]
             # 如果识别结果存在，提取并保存
             if results:
@@ -88,14 +127,39 @@ class CameraOCR:
 
             if time.time() - self.start_time > self.timeout:
                 print("识别完成!!!")
+                if self.gate is not None:
+                    stats = self.gate.stats()
+                    print(f"OCR运行 {self.ocr_frames} 帧，跳过 {stats['hits']}/{stats['frames']} 帧（{stats['hit_rate'] * 100:.1f}%）")
+                if self.coarse_to_fine is not None:
+                    counts = self.coarse_to_fine.stats()
+                    print(f"粗检 {counts['coarse']} 次，区域精检 {counts['fine']} 次，全图 {counts['full']} 次，"
+                          f"跳过全图 {counts['skipped']} 次，跟丢 {counts['lost']} 次")
+                if self.ocr.rec_cache is not None:
+                    cache = self.ocr.rec_cache.stats()
+                    print(f"识别缓存命中 {cache['hits']}/{cache['hits'] + cache['misses']} 行（{cache['hit_rate'] * 100:.1f}%），"
+                          f"像素校验拒绝 {cache['rejected']} 次，淘汰 {cache['evictions']} 行")
                 return self.recognized_texts
 
+    def _collect_pipeline(self):
+        # Take every finished frame, the newest one replaces the results of the previous frames
+        while True:
+            try:
+                _, self._last_results = self.pipeline.get(block=False)
+            except queue.Empty:
+                return self._last_results
+            except Exception as e:
+                print(f"OCR processing error: {e}")
+                self._last_results = []
+
     def release(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
         self.cap.release()
         cv2.destroyAllWindows()
 
-def recognize_text_from_camera(camera_index=22, timeout=30):
-    ocr_camera = CameraOCR(camera_index, timeout)
+def recognize_text_from_camera(camera_index=22, timeout=30, gate=None, pipelined=False, coarse_to_fine=False, rec_cache_size=0,
+                               fast_postprocess=False, score_mode='poly'):
+    ocr_camera = CameraOCR(camera_index, timeout, gate, pipelined, coarse_to_fine, rec_cache_size, fast_postprocess, score_mode)
     result = ocr_camera.recognize_once()
     ocr_camera.release()
     return result
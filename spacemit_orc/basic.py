@@ -1,23 +1,44 @@
+import os
 import cv2
 import numpy as np
-from onnxruntime import InferenceSession, SessionOptions
-import spacemit_ort
+from spacemit_runtime import get_session
 
 
+def read_image(img_obj):
+    """
+    Load an image given as a path, encoded bytes or an in-memory frame
+    :param img_obj: image path, encoded image bytes (jpg, png ...) or ndarray in BGR format
+    :return: BGR ndarray, an ndarray input is returned without a copy
+    """
+    if isinstance(img_obj, np.ndarray):
+        img = img_obj
+    elif isinstance(img_obj, (str, os.PathLike)):
+        img = cv2.imread(os.fspath(img_obj))
+        if img is None:
+            raise FileNotFoundError(f"Cannot read image {img_obj}")
+    elif isinstance(img_obj, (bytes, bytearray, memoryview)):
+        img = cv2.imdecode(np.frombuffer(img_obj, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Cannot decode image bytes")
+    else:
+        raise TypeError(f"Unsupported image type: {type(img_obj).__name__}")
+
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    elif img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    return img
+
 
 class Baseinfer:
     def __init__(self, model_path, use_cpu=False):
-        if use_cpu:
-            providers = ['CPUExecutionProvider']
-        else:
-            providers=["SpaceMITExecutionProvider"]       
-            
-
-        options = SessionOptions()        
-        options.intra_op_num_threads = 4
+        # None follows the shared provider policy (SpaceMIT first, CPU fallback)
+        providers = ['CPUExecutionProvider'] if use_cpu else None
 
-        self.model = InferenceSession(model_path, providers=providers, sess_options=options)
+        self.model = get_session(model_path, providers=providers)
         self.input_name = self.model.get_inputs()[0].name
+        # Models converted with spacemit_runtime.uint8_input take the raw uint8 [N, H, W, 3] BGR image
+        self.uint8_input = self.model.get_inputs()[0].type == 'tensor(uint8)'
 
     def __call__(self, *args, **kwargs):
         return self.forward(*args, **kwargs)
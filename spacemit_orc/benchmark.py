@@ -0,0 +1,256 @@
+"""
+benchmark.py
+Micro-benchmarks for the OCR pipeline
+
+Usage:
+    python -m spacemit_orc.benchmark frame-input --images spacemit_orc/data
+    python -m spacemit_orc.benchmark rec-batch --images spacemit_orc/data
+    python -m spacemit_orc.benchmark det-postprocess --images spacemit_orc/data
+    python -m spacemit_orc.benchmark rec-cache
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import cv2
+import numpy as np
+
+from .basic import read_image
+from .ocr import TextDetector, TextRecognizer, OCRProcessor
+from .rec_cache import RecognitionCache
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+DET_MODEL = 'spacemit_orc/models/ppocr3_det_fixed.onnx'
+REC_MODEL = 'spacemit_orc/models/ppocr_rec.onnx'
+REC_DICT = 'spacemit_orc/models/rec_word_dict.txt'
+# Voucher-like lines and the same line with one character changed
+CACHE_LINE_PAIRS = [('VOUCHER 2 YUAN', 'VOUCHER 5 YUAN'), ('VOUCHER 20 YUAN', 'VOUCHER 28 YUAN'), ('10 YUAN', '20 YUAN'),
+                    ('SUPERMARKET 1', 'SUPERMARKET 7'), ('COUPON 2', 'COUPON 5'), ('COUPON 5', 'COUPON 6'),
+                    ('TOTAL 3.50', 'TOTAL 3.80'), ('ITEM 8', 'ITEM 6'), ('NO 1111', 'NO 1117')]
+
+
+def load_images(paths, size=None):
+    """
+    Decode images and image folders into memory, resized to the camera resolution like the checkout frames
+    :param size: (w, h) or None to keep the original size
+    :return: list of (name, frame)
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            files.append(path)
+    frames = []
+    for path in files:
+        frame = cv2.imread(path)
+        if frame is None:
+            continue
+        if size is not None:
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        frames.append((os.path.basename(path), frame))
+    if not frames:
+        raise FileNotFoundError(', '.join(paths))
+    return frames
+
+
+def _time_it(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000
+
+
+def bench_frame_input(args):
+    frames = load_images(args.images, tuple(args.size) if args.size else None)
+    detector = TextDetector(args.det_model)
+    ocr = OCRProcessor(args.det_model, args.rec_model, args.rec_dict) if os.path.exists(args.rec_model) else None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        temp_path = os.path.join(tmp_dir, 'temp_frame.jpg')
+
+        def via_file(fn, frame):
+            # What the camera loops did before: encode and write every frame, then read and decode it again
+            cv2.imwrite(temp_path, frame)
+            return fn(temp_path)
+
+        print(f"{'image':<20} {'size':>9} {'file io ms':>11} {'det file ms':>12} {'det frame ms':>13} {'boxes':>7}"
+              + (f" {'ocr file ms':>12} {'ocr frame ms':>13}" if ocr else ''))
+        saved = []
+        for name, frame in frames:
+            t_io = _time_it(lambda: via_file(read_image, frame), args.repeat)
+            t_det_file = _time_it(lambda: via_file(detector.forward, frame), args.repeat)
+            t_det_frame = _time_it(lambda: detector.forward(frame), args.repeat)
+            # JPEG is lossy, the frame path sees the camera pixels instead of their re-encoded copy
+            boxes = f"{len(via_file(detector.forward, frame)[0])}/{len(detector.forward(frame)[0])}"
+            line = (f"{name:<20} {frame.shape[1]:>4}x{frame.shape[0]:<4} {t_io:>11.3f} {t_det_file:>12.3f} "
+                    f"{t_det_frame:>13.3f} {boxes:>7}")
+            if ocr:
+                line += f" {_time_it(lambda: via_file(ocr, frame), args.repeat):>12.3f} {_time_it(lambda: ocr(frame), args.repeat):>13.3f}"
+            print(line)
+            saved.append(t_io)
+    # The detector timings are too noisy on a loaded board to subtract, the round trip is measured on its own
+    print(f"saved per frame by passing frames directly: {np.median(saved):.3f} ms (median jpg write + read), boxes are file/frame")
+    if ocr is None:
+        print(f"{args.rec_model} not found, end-to-end OCR skipped")
+
+
+def bench_rec_batch(args):
+    frames = load_images(args.images, tuple(args.size) if args.size else None)
+    detector = TextDetector(args.det_model)
+    recognizer = TextRecognizer(args.rec_model, args.rec_dict, batch_size=args.batch_size)
+
+    print(f"{'image':<20} {'boxes':>6} {'buckets':>8} {'per-box ms':>11} {'batched ms':>11} {'speedup':>8} {'same':>5}")
+    for name, frame in frames:
+        results, ori_img = detector.forward(frame)
+        crops = list(detector.warp_box(results, ori_img))
+        if not crops:
+            print(f"{name:<20} {0:>6}")
+            continue
+        widths = {recognizer._bucket_width(c.shape[1], c.shape[0]) for c in crops}
+        # Padding to the bucket width can change a read, count how many lines agree with the unpadded path
+        same = sum(a == b for a, b in zip([recognizer.forward(c) for c in crops], recognizer.forward_batch(crops)))
+        t_single = _time_it(lambda: [recognizer.forward(c) for c in crops], args.repeat)
+        t_batch = _time_it(lambda: recognizer.forward_batch(crops), args.repeat)
+        print(f"{name:<20} {len(crops):>6} {len(widths):>8} {t_single:>11.3f} {t_batch:>11.3f} {t_single / t_batch:>7.1f}x "
+              f"{same:>2}/{len(crops)}")
+
+
+def _canonical_points(points):
+    # Same corner order warp_box uses: start at the top-left-most corner
+    return np.roll(points, 4 - points.sum(axis=1).argmin(), axis=0)
+
+
+def _compare_boxes(reference, candidate, max_distance):
+    """
+    Match two detector outputs by box center
+    :return: (number of matched boxes, largest corner distance in pixels, largest score difference) over the matches
+    """
+    used = set()
+    corner, score = 0.0, 0.0
+    for ref in reference:
+        distances = [np.hypot(*np.subtract(ref['center_point'], c['center_point'])) if j not in used else np.inf
+                     for j, c in enumerate(candidate)]
+        if not distances or min(distances) > max_distance:
+            continue
+        j = int(np.argmin(distances))
+        used.add(j)
+        corner = max(corner, float(np.abs(_canonical_points(ref['points']) - _canonical_points(candidate[j]['points'])).max()))
+        score = max(score, abs(float(ref['score']) - float(candidate[j]['score'])))
+    return len(used), corner, score
+
+
+def bench_det_postprocess(args):
+    frames = load_images(args.images, tuple(args.size) if args.size else None)
+    detector = TextDetector(args.det_model)
+
+    print(f"{'image':<20} {'mode':<10} {'ms':>8} {'speedup':>8} {'boxes':>6} {'matched':>8} {'corner px':>10} {'score diff':>11}")
+    for name, frame in frames:
+        input_img, _, ori_w, ori_h = detector._preprocess(frame)
+        confidence_mask = detector.model.run(None, {detector.input_name: detector._preprocess2(input_img)})[0][0, 0].copy()
+
+        reference = detector._postprocess(confidence_mask, ori_w, ori_h)
+        t_legacy = _time_it(lambda: detector._postprocess(confidence_mask, ori_w, ori_h), args.repeat)
+        print(f"{name:<20} {'legacy':<10} {t_legacy:>8.3f} {'':>8} {len(reference):>6}")
+        for mode in ('poly', 'box'):
+            detector.score_mode = mode
+            results = detector._postprocess_fast(confidence_mask, ori_w, ori_h)
+            t_fast = _time_it(lambda: detector._postprocess_fast(confidence_mask, ori_w, ori_h), args.repeat)
+            matched, corner, score = _compare_boxes(reference, results, args.max_distance)
+            print(f"{'':<20} {'fast-' + mode:<10} {t_fast:>8.3f} {t_legacy / t_fast:>7.1f}x {len(results):>6} "
+                  f"{matched:>8} {corner:>10.2f} {score:>11.4f}")
+
+
+def render_line(text, scale, rng, jitter=2, noise=4.0):
+    """
+    Text line as warp_box would crop it from a camera frame: dark text on a light voucher, the crop box moved by up
+    to jitter pixels on each side and sensor noise added
+    """
+    (w, h), base = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 2)
+    canvas = np.full((h + base + 40, w + 40), 235, np.uint8)
+    cv2.putText(canvas, text, (20, 20 + h), cv2.FONT_HERSHEY_SIMPLEX, scale, 30, 2, cv2.LINE_AA)
+    x0, y0, x1, y1 = np.array([14, 14, 26 + w, 26 + h + base]) + rng.integers(-jitter, jitter + 1, 4)
+    crop = canvas[y0:y1, x0:x1] + rng.normal(0, noise, (y1 - y0, x1 - x0))
+    return cv2.cvtColor(np.clip(crop, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+
+
+def bench_rec_cache(args):
+    rng = np.random.default_rng(args.seed)
+    print(f"{'line':<18} {'changed':<18} {'scale':>6} {'same hits':>10} {'wrong hits':>11} {'get ms':>7}")
+    wrong = 0
+    for text, changed in CACHE_LINE_PAIRS:
+        for scale in args.scales:
+            same_hits, wrong_hits, times = 0, 0, []
+            for _ in range(args.trials):
+                cache = RecognitionCache()
+                img = render_line(text, scale, rng)
+                key = cache.key(img)
+                cache.put(key, text, cache.get(key, img)[1])
+                # A line differing in one character must never come back with the cached text
+                img = render_line(changed, scale, rng)
+                start = time.perf_counter()
+                wrong_hits += cache.get(cache.key(img), img)[0] is not None
+                times.append(time.perf_counter() - start)
+                img = render_line(text, scale, rng)
+                same_hits += cache.get(cache.key(img), img)[0] == text
+            wrong += wrong_hits
+            print(f"{text:<18} {changed:<18} {scale:>6.2f} {same_hits:>4}/{args.trials:<5} {wrong_hits:>5}/{args.trials:<5} "
+                  f"{np.median(times) * 1000:>7.3f}")
+    if wrong:
+        print(f"{wrong} lines returned the result of a different line")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OCR benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    frame_parser = sub.add_parser('frame-input', help='Compare passing camera frames directly against the temporary jpg round trip')
+    frame_parser.add_argument('--images', type=str, nargs='+', default=['spacemit_orc/data'], help='Images or image folders')
+    frame_parser.add_argument('--size', type=int, nargs=2, default=[640, 480], metavar=('W', 'H'),
+                              help='Resize to the camera resolution, 0 0 keeps the original size')
+    frame_parser.add_argument('--det-model', type=str, default=DET_MODEL, help='Text detection model')
+    frame_parser.add_argument('--rec-model', type=str, default=REC_MODEL, help='Text recognition model, skipped when missing')
+    frame_parser.add_argument('--rec-dict', type=str, default=REC_DICT, help='Text library of the recognition model')
+    frame_parser.add_argument('--repeat', type=int, default=20, help='Number of timed runs per image')
+    frame_parser.set_defaults(func=bench_frame_input)
+
+    rec_parser = sub.add_parser('rec-batch', help='Compare recognizing each text box on its own against width-bucketed batches')
+    rec_parser.add_argument('--images', type=str, nargs='+', default=['spacemit_orc/data'], help='Images or image folders')
+    rec_parser.add_argument('--size', type=int, nargs=2, default=[640, 480], metavar=('W', 'H'),
+                            help='Resize to the camera resolution, 0 0 keeps the original size')
+    rec_parser.add_argument('--det-model', type=str, default=DET_MODEL, help='Text detection model')
+    rec_parser.add_argument('--rec-model', type=str, default=REC_MODEL, help='Text recognition model')
+    rec_parser.add_argument('--rec-dict', type=str, default=REC_DICT, help='Text library of the recognition model')
+    rec_parser.add_argument('--batch-size', type=int, default=8, help='Maximum number of text lines per session run')
+    rec_parser.add_argument('--repeat', type=int, default=10, help='Number of timed runs per image')
+    rec_parser.set_defaults(func=bench_rec_batch)
+
+    det_parser = sub.add_parser('det-postprocess', help='Compare the legacy and fast text detector post-processing')
+    det_parser.add_argument('--images', type=str, nargs='+', default=['spacemit_orc/data'], help='Images or image folders')
+    det_parser.add_argument('--size', type=int, nargs=2, default=[640, 480], metavar=('W', 'H'),
+                            help='Resize to the camera resolution, 0 0 keeps the original size')
+    det_parser.add_argument('--det-model', type=str, default=DET_MODEL, help='Text detection model')
+    det_parser.add_argument('--max-distance', type=float, default=4.0, help='Largest center distance in pixels for two boxes to match')
+    det_parser.add_argument('--repeat', type=int, default=50, help='Number of timed runs per image')
+    det_parser.set_defaults(func=bench_det_postprocess)
+
+    cache_parser = sub.add_parser('rec-cache', help='Check that the recognition cache never returns the result of a line '
+                                                    'differing in one character, and its hit rate on repeated lines')
+    cache_parser.add_argument('--scales', type=float, nargs='+', default=[0.45, 0.8, 1.2], help='cv2.putText font scales')
+    cache_parser.add_argument('--trials', type=int, default=20, help='Number of rendered pairs per line and scale')
+    cache_parser.add_argument('--seed', type=int, default=0, help='Seed of the box jitter and noise')
+    cache_parser.set_defaults(func=bench_rec_cache)
+
+    args = parser.parse_args()
+    if getattr(args, 'size', None) == [0, 0]:
+        args.size = None
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
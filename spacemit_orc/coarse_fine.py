@@ -0,0 +1,116 @@
+"""
+coarse_fine.py
+Coarse-to-fine OCR for a voucher that covers a small part of the camera frame: the text detector runs on a downscaled
+frame to find the text region, then only that region is cropped at full resolution for detection refinement and
+recognition. The region is tracked from the refined boxes of each frame, and a full-frame pass runs on the same frame
+when it is lost. While no voucher is in view the full-frame pass backs off, so empty frames mostly cost the coarse pass.
+"""
+
+import cv2
+import numpy as np
+
+
+class CoarseToFineOCR:
+    def __init__(self, ocr, coarse_scale=0.5, margin=0.25, min_region=96, refresh_interval=30, miss_backoff=5):
+        """
+        :param ocr: OCRProcessor
+        :param coarse_scale: frame scale of the region-finding pass
+        :param margin: padding added around the text boxes on each side, as a fraction of the region size
+        :param min_region: smallest side of the cropped region in pixels
+        :param refresh_interval: rerun the coarse pass after this many tracked frames to catch text appearing elsewhere,
+                                 0 to never refresh while tracking
+        :param miss_backoff: after a full-frame pass that found no text, frames the coarse pass misses are skipped
+                             instead of read in full for this many frames, 0 runs the full pass on every miss
+        """
+        self.ocr = ocr
+        self.coarse_scale = coarse_scale
+        self.margin = margin
+        self.min_region = min_region
+        self.refresh_interval = refresh_interval
+        self.miss_backoff = miss_backoff
+        self.region = None  # (x0, y0, x1, y1) of the tracked text region in frame coordinates
+        self._tracked = 0   # Frames since the last coarse pass
+        self._backoff = 0   # Coarse misses left that skip the full-frame pass
+
+        self.counts = {'coarse': 0, 'fine': 0, 'full': 0, 'lost': 0, 'skipped': 0}
+
+    def __call__(self, *args, **kwargs):
+        return self.forward(*args, **kwargs)
+
+    def reset(self):
+        self.region = None
+        self._tracked = 0
+        self._backoff = 0
+
+    def forward(self, frame):
+        """
+        OCR of one camera frame
+        :param frame: BGR ndarray
+        :return: same as OCRProcessor.forward, in frame coordinates
+        """
+        h, w = frame.shape[:2]
+        if self.region is None or (self.refresh_interval and self._tracked >= self.refresh_interval):
+            self.region = self._coarse_region(frame)
+            self._tracked = 0
+            if self.region is None:
+                if self._backoff > 0:
+                    # The last full-frame pass found nothing either, most likely no voucher is in view
+                    self._backoff -= 1
+                    self.counts['skipped'] += 1
+                    return []
+                # Nothing found at low resolution, read the whole frame instead
+                return self._full_pass(frame)
+            self._backoff = 0
+
+        x0, y0, x1, y1 = self.region
+        self.counts['fine'] += 1
+        self._tracked += 1
+        results, warp_imgs = self.ocr.detect(frame[y0:y1, x0:x1])
+        if not results:
+            # The voucher left the region, search the whole frame for it
+            self.counts['lost'] += 1
+            return self._full_pass(frame)
+
+        offset = np.array([x0, y0], dtype=np.float32)
+        for result in results:
+            result['points'] = result['points'] + offset
+            result['center_point'] = (result['center_point'][0] + x0, result['center_point'][1] + y0)
+        self.region = self._region_around([r['points'] for r in results], w, h)
+        return self.ocr.recognize_results(results, warp_imgs)
+
+    def stats(self):
+        return {**self.counts, 'region': self.region}
+
+    def _full_pass(self, frame):
+        self.counts['full'] += 1
+        self._tracked = 0
+        results = self.ocr(frame)
+        h, w = frame.shape[:2]
+        self.region = self._region_around([r['points'] for r in results], w, h)
+        if self.region is None:
+            self._backoff = self.miss_backoff
+        return results
+
+    def _coarse_region(self, frame):
+        self.counts['coarse'] += 1
+        small = cv2.resize(frame, None, fx=self.coarse_scale, fy=self.coarse_scale, interpolation=cv2.INTER_AREA)
+        results, _ = self.ocr.text_detector.forward(small)
+        h, w = frame.shape[:2]
+        return self._region_around([r['points'] / self.coarse_scale for r in results], w, h)
+
+    def _region_around(self, boxes, w, h):
+        """
+        Bounding rectangle of all boxes with the margin added, clipped to the frame
+        :return: (x0, y0, x1, y1) or None without boxes
+        """
+        if not boxes:
+            return None
+        points = np.concatenate(boxes)
+        (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+        pad_x = max((x1 - x0) * self.margin, (self.min_region - (x1 - x0)) / 2, 0)
+        pad_y = max((y1 - y0) * self.margin, (self.min_region - (y1 - y0)) / 2, 0)
+        x0, x1 = int(max(0, np.floor(x0 - pad_x))), int(min(w, np.ceil(x1 + pad_x)))
+        y0, y1 = int(max(0, np.floor(y0 - pad_y))), int(min(h, np.ceil(y1 + pad_y)))
+        if x1 - x0 < 8 or y1 - y0 < 8:
+            return None
+        return x0, y0, x1, y1
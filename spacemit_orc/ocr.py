@@ -3,18 +3,27 @@ import numpy as np
 from pyclipper import PyclipperOffset, JT_ROUND, ET_CLOSEDPOLYGON
 from math import ceil
 from typing import Union, Tuple, Iterator, Optional, List
-from .basic import Baseinfer
+from .basic import Baseinfer, read_image
+from .rec_cache import RecognitionCache
 
 class TextDetector(Baseinfer):
     def __init__(self, model_path: str,
                  min_score: float = 0.6,
-                 use_cpu: bool = False):
+                 use_cpu: bool = False,
+                 fast_postprocess: bool = False,
+                 score_mode: str = 'poly'):
         """
         Text detector
         :param model_path: Path to the text detection model
         :param min_score: Minimum confidence score required for text box detection              
+        :param use_cpu: Whether to use only CPU
+        :param fast_postprocess: Pre-filter contours before scoring them and expand all boxes at once, see _postprocess_fast
+        :param score_mode: Box score of the fast post-processing, 'poly' averages inside the contour, 'box' inside its bounding rectangle,
+                           which is cheaper but includes background and scores lower, so min_score usually needs lowering with it
         """
         super().__init__(model_path, use_cpu)
+        if score_mode not in ('poly', 'box'):
+            raise ValueError(f"Unsupported score mode: {score_mode}")
 
         self._limit_side_len = 960
         self._input_mean = np.float32([0.485, 0.456, 0.406]).reshape((1, 1, 3))
@@ -24,6 +33,8 @@ class TextDetector(Baseinfer):
         self.box_threshold = min_score
         self.max_candidates = 1000
         self.expansion_ratio = 1.6
+        self.fast_postprocess = fast_postprocess
+        self.score_mode = score_mode
 
     def _preprocess(self, img_obj: Union[str, bytes, np.ndarray]) -> Tuple[np.ndarray, np.ndarray, int, int]:
         """
@@ -31,8 +42,8 @@ class TextDetector(Baseinfer):
         :param img_obj: image object
         :return: returns four parameters, the first one is the processed image, the second one is the original image, and the third and fourth ones are the width and height of the image respectively
         """
-        image = cv2.imread(img_obj)
-        img = np.array(image)
+        # Camera frames are used as they are, only paths and encoded bytes are decoded
+        img = read_image(img_obj)
 
         h, w = img.shape[:2]
         if (max_side := max(h, w)) > self._limit_side_len:
@@ -52,6 +63,9 @@ class TextDetector(Baseinfer):
         :param input_img: preprocessed image
         :return: data available for model input
         """
+        if self.uint8_input:
+            # Normalization and layout are part of the model
+            return input_img[np.newaxis, ...]
         input_tensor = input_img.astype(np.float32)
         input_tensor /= 255
         input_tensor -= self._input_mean
@@ -105,6 +119,74 @@ class TextDetector(Baseinfer):
 
         return ocr_results
 
+    def _postprocess_fast(self, confidence_mask: np.ndarray, ori_w: int, ori_h: int) -> List[dict]:
+        """
+        Post-processing with the per-contour work cut down: flat contour retrieval, contours too small for a text box
+        are dropped by area and bounding rectangle before scoring, and the box expansion is computed for all boxes at once.
+        The rounded pyclipper offset of a rectangle by d has the minimum area rectangle of size (w + 2d, h + 2d),
+        so the expansion is done on the rectangles directly.
+        :param confidence_mask: Model inference result
+        :param ori_w: original image width
+        :param ori_h: original image height
+        :return: Returns a list of dictionaries containing text area position, text area confidence, and text area center point
+        """
+        height, width = confidence_mask.shape
+        mask = (confidence_mask > self.threshold).astype(np.uint8)
+        contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+        min_area = self.min_size * self.min_size
+        candidates = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w < self.min_size or h < self.min_size or w * h < min_area:
+                continue
+            candidates.append((w * h, contour, (x, y, w, h)))
+        # The largest regions first when there are too many
+        if len(candidates) > self.max_candidates:
+            candidates.sort(key=lambda c: -c[0])
+            candidates = candidates[:self.max_candidates]
+
+        rects, scores = [], []
+        for _, contour, (x, y, w, h) in candidates:
+            rect_obj = cv2.minAreaRect(contour)
+            if min(rect_obj[1]) < self.min_size:
+                continue
+
+            region = confidence_mask[y:y+h, x:x+w]
+            if self.score_mode == 'box':
+                score = region.mean()
+            else:
+                mask2 = np.zeros((h, w), dtype=np.uint8)
+                cv2.fillPoly(mask2, [contour - np.array([x, y], dtype=contour.dtype)], (1,))
+                score = region[mask2 == 1].mean()
+            if score < self.box_threshold:
+                continue
+            rects.append((*rect_obj[0], *rect_obj[1], rect_obj[2]))
+            scores.append(score)
+
+        if not rects:
+            return []
+
+        # Expand every rectangle by area * ratio / perimeter on each side
+        cx, cy, w, h, angle = np.array(rects, dtype=np.float64).T
+        distance = w * h * self.expansion_ratio / (2 * (w + h))
+        w, h = w + 2 * distance, h + 2 * distance
+        keep = np.minimum(w, h) >= self.min_size + 2
+
+        # cv2.boxPoints for all rectangles, then scale to the original image
+        theta = np.deg2rad(angle)
+        b, a = np.cos(theta) * 0.5, np.sin(theta) * 0.5
+        p0 = np.stack([cx - a * h - b * w, cy + b * h - a * w], axis=1)
+        p1 = np.stack([cx + a * h - b * w, cy - b * h - a * w], axis=1)
+        centers = np.stack([cx, cy], axis=1)
+        points = np.stack([p0, p1, 2 * centers - p0, 2 * centers - p1], axis=1)
+        scale = np.array([ori_w / width, ori_h / height])
+        points = (points * scale).astype(np.float32)
+        centers = centers * scale
+
+        return [{'points': points[i], 'score': scores[i], 'center_point': (centers[i, 0], centers[i, 1])}
+                for i in np.flatnonzero(keep)]
+
     def forward(self, img_obj: Union[str, bytes, np.ndarray]) -> Tuple[list, np.ndarray]:
         """
         Input image to get text box information
@@ -114,7 +196,8 @@ class TextDetector(Baseinfer):
         input_img, ori_img, ori_w, ori_h = self._preprocess(img_obj)
         input_tensor = self._preprocess2(input_img)
         output_tensor = self.model.run(None, {self.input_name: input_tensor})[0][0, 0]
-        return self._postprocess(output_tensor, ori_w, ori_h), ori_img
+        postprocess = self._postprocess_fast if self.fast_postprocess else self._postprocess
+        return postprocess(output_tensor, ori_w, ori_h), ori_img
 
     @staticmethod
     def warp_box(det_results: List[dict], ori_img: np.ndarray) -> Iterator:
@@ -162,7 +245,8 @@ class TextClassifier(Baseinfer):
         :param img_obj: image object
         :return: returns the processed image
         """
-        img = img_obj.copy()
+        # cv2.resize writes a new image, the crop itself is never modified
+        img = read_image(img_obj)
         h, w = img.shape[:2]
         scale = self._input_size[1] / h
         obj_w = ceil(w * scale)
@@ -178,6 +262,9 @@ class TextClassifier(Baseinfer):
         :param input_img: preprocessed image
         :return: data available for model input
         """
+        if self.uint8_input:
+            # Normalization and layout are part of the model
+            return input_img[np.newaxis, ...]
         input_tensor = input_img.transpose((2, 0, 1)).astype(np.float32)
         input_tensor -= self._input_mean
         input_tensor /= self._input_std
@@ -209,13 +296,17 @@ class TextRecognizer(Baseinfer):
     def __init__(self, model_path: str,
                  text_path: str,
                  rec_threshold: float = 0.5,                
-                 use_cpu: bool = False):
+                 use_cpu: bool = False,
+                 batch_size: int = 8,
+                 width_buckets: Tuple[int, ...] = (80, 160, 240, 320, 480, 640, 960, 1280)):
         """
         Text recognizer
         :param model_path: Path to the text recognition model
         :param text_path: Path to the text library
         :param rec_threshold: Confidence of text recognition, meaningless
         :param use_cpu: Whether to use only CPU
+        :param batch_size: Maximum number of text lines per session run in forward_batch
+        :param width_buckets: Input widths text lines are padded to in forward_batch, wider lines are padded to a multiple of 320
         """
         super().__init__(model_path, use_cpu)
 
@@ -225,6 +316,15 @@ class TextRecognizer(Baseinfer):
         self._input_std = 127.5
         with open(text_path, 'r', encoding='utf8') as f:
             self._texts = f.read().replace('\n', '') + ' '
+        # Class 0 is the CTC blank, class i is self._texts[i - 1]
+        self._characters = np.array([''] + list(self._texts))
+
+        # Models exported with a fixed batch or width only take that size
+        shape = self.model.get_inputs()[0].shape
+        batch_dim, width_dim = shape[0], shape[2] if self.uint8_input else shape[3]
+        self.batch_size = batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else batch_size
+        self.width_buckets = (width_dim,) if isinstance(width_dim, int) and width_dim > 0 else tuple(sorted(width_buckets))
+        self._fixed_width = len(self.width_buckets) == 1 and self.width_buckets[0] == width_dim
 
     def _preprocess(self, img_obj: Union[str, bytes, np.ndarray]) -> np.ndarray:
         """
@@ -232,8 +332,8 @@ class TextRecognizer(Baseinfer):
         :param img_obj: image object
         :return: returns the processed image
         """
-        #img = read_image(img_obj)
-        img = img_obj.copy()
+        # cv2.resize writes a new image, the crop itself is never modified
+        img = read_image(img_obj)
         h, w = img.shape[:2]
         scale = self._input_size[1] / h
         obj_w = ceil(w * scale)
@@ -247,6 +347,9 @@ class TextRecognizer(Baseinfer):
         :param input_img: preprocessed image
         :return: data available for model input
         """
+        if self.uint8_input:
+            # Normalization and layout are part of the model
+            return input_img[np.newaxis, ...]
         input_tensor = input_img.transpose((2, 0, 1)).astype(np.float32)
         input_tensor -= self._input_mean
         input_tensor /= self._input_std
@@ -258,20 +361,108 @@ class TextRecognizer(Baseinfer):
         :param each_output: model inference results
         :return: text recognition results
         """
-        text_idx_li = each_output.argmax(axis=1)
-        content = ''.join([self._texts[i - 1] for idx, i in enumerate(text_idx_li) if i != 0 and not (idx > 0 and text_idx_li[idx - 1] == text_idx_li[idx])])
-        return content
+        return self.decode(each_output[np.newaxis])[0][0]
+
+    def decode(self, outputs: np.ndarray) -> Tuple[List[str], List[float], List[np.ndarray]]:
+        """
+        CTC greedy decoding of a whole batch: repeats are collapsed and blanks removed with masks over all timesteps
+        :param outputs: model inference results, [N, T, C] probabilities
+        :return: texts, mean character confidence of each text (0 for empty texts) and per-character confidences
+        """
+        text_idx = outputs.argmax(axis=2)
+        probs = np.take_along_axis(outputs, text_idx[..., np.newaxis], axis=2)[..., 0]
+        keep = text_idx != 0
+        keep[:, 1:] &= text_idx[:, 1:] != text_idx[:, :-1]
+
+        chars = self._characters[text_idx[keep]].tolist()
+        char_probs = probs[keep]
+        bounds = np.concatenate(([0], np.cumsum(keep.sum(axis=1))))
+        texts, scores, char_scores = [], [], []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            texts.append(''.join(chars[start:end]))
+            char_scores.append(char_probs[start:end])
+            scores.append(float(char_probs[start:end].mean()) if end > start else 0.0)
+        return texts, scores, char_scores
 
-    def forward(self, img_obj: Union[str, bytes, np.ndarray]) -> str:
+    def forward(self, img_obj: Union[str, bytes, np.ndarray], return_scores: bool = False) -> Union[str, Tuple[str, float, np.ndarray]]:
         """
         Input image to get text recognition result
         :param img_obj: image object
-        :return: text recognition result
+        :param return_scores: also return the mean confidence and the per-character confidences
+        :return: text recognition result, or (text, score, character scores)
         """
         input_img = self._preprocess(img_obj)
         input_tensor = self._preprocess2(input_img)
-        outputs = self.model.run(None, {self.input_name: input_tensor})[0][0]
-        return self._postprocess(outputs)
+        outputs = self.model.run(None, {self.input_name: input_tensor})[0]
+        texts, scores, char_scores = self.decode(outputs)
+        return (texts[0], scores[0], char_scores[0]) if return_scores else texts[0]
+
+    def _bucket_width(self, w: int, h: int) -> int:
+        """
+        Input width a text line of size w x h is padded to
+        """
+        obj_w = ceil(w * self._input_size[1] / h)
+        for width in self.width_buckets:
+            if obj_w <= width:
+                return width
+        if self._fixed_width:
+            return self.width_buckets[-1]
+        return ceil(obj_w / 320) * 320
+
+    def _preprocess_batch(self, imgs: List[np.ndarray], width: int) -> np.ndarray:
+        """
+        Resize text lines to the model height and pad them to a common width
+        :param imgs: text line images
+        :param width: bucket width
+        :return: data available for model input
+        """
+        height = self._input_size[1]
+        if self.uint8_input:
+            # The mean is the padding value, it normalizes to ~0 inside the model
+            batch = np.full((len(imgs), height, width, 3), 127, dtype=np.uint8)
+        else:
+            batch = np.zeros((len(imgs), 3, height, width), dtype=np.float32)
+
+        for i, img in enumerate(imgs):
+            h, w = img.shape[:2]
+            scale = height / h
+            obj_w = min(ceil(w * scale), width)
+            img2 = cv2.resize(img, (obj_w, height), interpolation=cv2.INTER_AREA if scale <= 1 else cv2.INTER_CUBIC)
+            if self.uint8_input:
+                batch[i, :, :obj_w] = img2
+            else:
+                target = batch[i, :, :, :obj_w]
+                np.copyto(target, img2.transpose((2, 0, 1)))
+                target -= self._input_mean
+                target /= self._input_std
+        return batch
+
+    def forward_batch(self, img_list: List[np.ndarray], return_scores: bool = False) -> List[Union[str, Tuple[str, float, np.ndarray]]]:
+        """
+        Recognize several text lines with one session run per width bucket.
+        Lines are sorted by aspect ratio and padded to the width bucket they fall into, so only a few input shapes occur.
+        :param img_list: text line images
+        :param return_scores: also return the mean confidence and the per-character confidences of each line
+        :return: text recognition results in the order of img_list, or (text, score, character scores) tuples
+        """
+        imgs = [read_image(img) for img in img_list]
+        widths = [self._bucket_width(img.shape[1], img.shape[0]) for img in imgs]
+        order = sorted(range(len(imgs)), key=lambda i: imgs[i].shape[1] / imgs[i].shape[0])
+
+        contents = [('', 0.0, np.empty(0, dtype=np.float32))] * len(imgs)
+        start = 0
+        while start < len(order):
+            width = widths[order[start]]
+            end = start + 1
+            while end < len(order) and end - start < self.batch_size and widths[order[end]] == width:
+                end += 1
+            group = order[start:end]
+            input_tensor = self._preprocess_batch([imgs[i] for i in group], width)
+            outputs = self.model.run(None, {self.input_name: input_tensor})[0]
+            for i, content in zip(group, zip(*self.decode(outputs))):
+                contents[i] = content
+            start = end
+        return contents if return_scores else [content[0] for content in contents]
 
 
 class OCRProcessor:
@@ -280,7 +471,12 @@ class OCRProcessor:
                  text_path: str,
                  cls_model_path: Optional[str] = None,                
                  use_cpu: bool = False,
-                 save_warp_img: bool = False):
+                 save_warp_img: bool = False,
+                 rec_batch_size: int = 8,
+                 min_rec_score: float = 0.0,
+                 rec_cache_size: int = 0,
+                 fast_postprocess: bool = False,
+                 score_mode: str = 'poly'):
         """
         Text recognition
         :param det_model_path: Path to the text detection model
@@ -289,11 +485,20 @@ class OCRProcessor:
         :param cls_model_path: Path to the text direction classifier model. If direction detection is not required, this item can be cancelled to increase the speed
         :param use_cpu: Whether to use only CPU
         :param save_warp_img: Save each text area image, not saved by default
-        """
-        self.text_detector = TextDetector(det_model_path,use_cpu=use_cpu)
-        self.text_recognizer = TextRecognizer(rec_model_path, text_path, use_cpu=use_cpu)
+        :param rec_batch_size: Maximum number of text boxes recognized per session run, 1 recognizes each box on its own
+        :param min_rec_score: Texts whose mean character confidence is below this are dropped
+        :param rec_cache_size: Number of text line results kept in an LRU cache keyed by a hash of the line image and
+                               verified against its pixels, 0 disables it
+        :param fast_postprocess: Use the fast post-processing of the text detector, see TextDetector
+        :param score_mode: Box score of the fast post-processing, 'poly' or 'box', see TextDetector
+        """
+        self.text_detector = TextDetector(det_model_path,use_cpu=use_cpu, fast_postprocess=fast_postprocess, score_mode=score_mode)
+        self.text_recognizer = TextRecognizer(rec_model_path, text_path, use_cpu=use_cpu, batch_size=rec_batch_size)
         self.text_classifier = TextClassifier(cls_model_path, use_cpu=use_cpu) if cls_model_path else None
         self.save_warp_img = save_warp_img
+        self.rec_batch_size = rec_batch_size
+        self.min_rec_score = min_rec_score
+        self.rec_cache = RecognitionCache(rec_cache_size) if rec_cache_size > 0 else None
 
 
     def __call__(self, *args, **kwargs):
@@ -303,21 +508,41 @@ class OCRProcessor:
         """
         Input image to get the result after text recognition
         :param img_obj: image path, image byte data or ndarray array in BGR format
-        :return: Returns a list of dictionaries containing recognition results, text area location, text area confidence, and text area center point
+        :return: Returns a list of dictionaries containing recognition results, text area location, text area confidence, text area center point,
+                 recognition confidence and per-character confidences
         """
-        results, ori_img = self.text_detector.forward(img_obj)
-        ocr_results = []
+        return self.recognize_results(*self.detect(img_obj))
 
-        for idx, i in enumerate(self.text_detector.warp_box(results, ori_img)):
+    def detect(self, img_obj: Union[str, bytes, np.ndarray]) -> Tuple[List[dict], List[np.ndarray]]:
+        """
+        First half of forward: text detection, box warping and direction classification
+        :param img_obj: image path, image byte data or ndarray array in BGR format
+        :return: text box information of the detector and the upright text line image of each box
+        """
+        results, ori_img = self.text_detector.forward(img_obj)
+        warp_imgs = []
+        for i in self.text_detector.warp_box(results, ori_img):
             if self.text_classifier is not None:
                 angle = self.text_classifier.forward(i)
                 if angle == 180:
-                    i = cv2.rotate(i, cv2.ROTATE_180)            
-            content = self.text_recognizer.forward(i)
-            if not content:
+                    i = cv2.rotate(i, cv2.ROTATE_180)
+            warp_imgs.append(i)
+        return results, warp_imgs
+
+    def recognize_results(self, results: List[dict], warp_imgs: List[np.ndarray]) -> List[dict]:
+        """
+        Second half of forward: text recognition of the boxes returned by detect
+        :return: same as forward
+        """
+        ocr_results = []
+        contents = self.recognize(warp_imgs)
+        for idx, (i, (content, rec_score, char_scores)) in enumerate(zip(warp_imgs, contents)):
+            if not content or rec_score < self.min_rec_score:
                 continue
 
             results[idx]['content'] = content
+            results[idx]['rec_score'] = rec_score
+            results[idx]['char_scores'] = char_scores
             ocr_results.append(results[idx])
             if self.save_warp_img:
                 cv2.imwrite(f'{idx}.jpg', i)
@@ -325,6 +550,33 @@ class OCRProcessor:
         return ocr_results[::-1]
 
 
+    def recognize(self, warp_imgs: List[np.ndarray]) -> List[Tuple[str, float, np.ndarray]]:
+        """
+        Recognize text line images, lines found in the recognition cache are not run through the model
+        :param warp_imgs: text line images from warp_box
+        :return: (text, score, character scores) of each line
+        """
+        keys, contents, pixels = [None] * len(warp_imgs), [None] * len(warp_imgs), [None] * len(warp_imgs)
+        if self.rec_cache is not None:
+            for idx, img in enumerate(warp_imgs):
+                keys[idx] = self.rec_cache.key(img)
+                # The normalized pixels of a miss are stored with its result, they are not computed twice
+                contents[idx], pixels[idx] = self.rec_cache.get(keys[idx], img)
+        missing = [idx for idx, content in enumerate(contents) if content is None]
+        if not missing:
+            return contents
+
+        if self.rec_batch_size > 1:
+            recognized = self.text_recognizer.forward_batch([warp_imgs[idx] for idx in missing], return_scores=True)
+        else:
+            recognized = [self.text_recognizer.forward(warp_imgs[idx], return_scores=True) for idx in missing]
+        for idx, content in zip(missing, recognized):
+            contents[idx] = content
+            if keys[idx] is not None:
+                self.rec_cache.put(keys[idx], content, pixels[idx])
+        return contents
+
+
 def main():
     from argparse import ArgumentParser
     import time
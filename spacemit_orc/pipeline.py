@@ -0,0 +1,155 @@
+"""
+pipeline.py
+Two-stage OCR pipeline: text detection (with warping and direction classification) of frame N+1 runs on one thread
+while text recognition of frame N runs on another. Frames go through bounded FIFO queues, so results come back
+in submission order and a slow consumer blocks the producer instead of queuing frames without limit.
+"""
+
+import queue
+import threading
+from spacemit_runtime.profiling import StageCounter
+
+_STOP = object()
+
+
+class OCRPipeline:
+    def __init__(self, ocr, queue_size=2):
+        """
+        :param ocr: OCRProcessor, its detector and recognizer must not be used elsewhere while the pipeline runs
+        :param queue_size: depth of each bounded queue between stages
+        """
+        self.ocr = ocr
+        self.queue_size = queue_size
+        self.input_queue = queue.Queue(maxsize=queue_size)   # submit -> detection
+        self.det_queue = queue.Queue(maxsize=queue_size)     # detection -> recognition
+        self.output_queue = queue.Queue(maxsize=queue_size)  # recognition -> get
+        self.counters = {'det': StageCounter(), 'rec': StageCounter()}
+        self.pending = 0  # Frames submitted but not returned by get yet
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._threads = [threading.Thread(target=self._det_loop, daemon=True),
+                         threading.Thread(target=self._rec_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        """
+        Finish the submitted frames and stop the workers, results still queued are dropped
+        """
+        if not self._threads:
+            return
+        stopping = False
+        while any(thread.is_alive() for thread in self._threads):
+            if not stopping:
+                # With every queue full the input queue only gets room once the output queue is drained
+                try:
+                    self.input_queue.put(_STOP, timeout=0.05)
+                    stopping = True
+                except queue.Full:
+                    pass
+            # Keep draining so a full output queue cannot block the workers
+            try:
+                self.output_queue.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        # Results finished after the last drain must not come back from a restarted pipeline
+        for q in (self.input_queue, self.det_queue, self.output_queue):
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+        self._threads = []
+        self.pending = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, frame, block=True, timeout=None):
+        """
+        Queue a frame for OCR
+        :param frame: BGR ndarray (or path / encoded bytes)
+        :param block: wait for room in the input queue
+        :return: False when the queue was full and the frame was not queued
+        """
+        try:
+            self.input_queue.put(frame, block=block, timeout=timeout)
+        except queue.Full:
+            return False
+        with self._lock:
+            self.pending += 1
+        return True
+
+    def get(self, block=True, timeout=None):
+        """
+        Results of the oldest submitted frame that has not been returned yet
+        :return: (frame, ocr results) as OCRProcessor.forward returns them
+        :raises queue.Empty: no result within the timeout
+        :raises Exception: the error OCR raised on that frame
+        """
+        frame, results = self.output_queue.get(block=block, timeout=timeout)
+        with self._lock:
+            self.pending -= 1
+        if isinstance(results, Exception):
+            raise results
+        return frame, results
+
+    def map(self, frames):
+        """
+        Run OCR over an iterable of frames with detection and recognition overlapped
+        :return: generator of (frame, ocr results) in input order
+        """
+        self.start()
+        # More frames in flight than the queues hold could block submit and get at the same time
+        max_pending = self.queue_size + 2
+        for frame in frames:
+            while self.pending >= max_pending:
+                yield self.get()
+            self.submit(frame)
+        while self.pending:
+            yield self.get()
+
+    def stats(self):
+        return {
+            'fps': {name: round(counter.fps, 2) for name, counter in self.counters.items()},
+            'frames': {name: counter.count for name, counter in self.counters.items()},
+            'queue_depth': {'input': self.input_queue.qsize(), 'det': self.det_queue.qsize(), 'output': self.output_queue.qsize()},
+            'pending': self.pending,
+        }
+
+    def _det_loop(self):
+        while True:
+            frame = self.input_queue.get()
+            if frame is _STOP:
+                self.det_queue.put(_STOP)
+                return
+            try:
+                item = self.ocr.detect(frame)
+            except Exception as e:
+                item = e
+            self.counters['det'].tick()
+            self.det_queue.put((frame, item))
+
+    def _rec_loop(self):
+        while True:
+            item = self.det_queue.get()
+            if item is _STOP:
+                return
+            frame, detected = item
+            if isinstance(detected, Exception):
+                results = detected
+            else:
+                try:
+                    results = self.ocr.recognize_results(*detected)
+                except Exception as e:
+                    results = e
+            self.counters['rec'].tick()
+            self.output_queue.put((frame, results))
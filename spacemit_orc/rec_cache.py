@@ -0,0 +1,172 @@
+"""
+rec_cache.py
+LRU cache of text recognition results keyed by a difference hash (dHash) of the text line image,
+so a text line that was read a moment ago is not recognized again.
+Camera noise and the box jitter of the detector flip the gradient signs in flat areas, so only gradients stronger
+than a margin count and two lines are candidates when few of the bits both of them are sure about differ.
+The hash cannot tell lines apart that differ in one character ("VOUCHER 2 YUAN" / "VOUCHER 5 YUAN"), so every
+candidate is verified against the stored pixels of its line: after aligning the two crops by their row and column
+profiles, no character-sized window may contain more than a few strongly differing pixels.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+import cv2
+import numpy as np
+
+# aspect: log2 aspect ratio bucket, bits: packed gradient signs, confident: packed mask of gradients above the margin
+Fingerprint = namedtuple('Fingerprint', ['aspect', 'bits', 'confident'])
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+
+
+def _profile(img, axis):
+    # Mean of the columns (axis 0) or rows (axis 1)
+    return cv2.reduce(img, axis, cv2.REDUCE_AVG, dtype=cv2.CV_32F).ravel()
+
+
+class RecognitionCache:
+    def __init__(self, max_size=256, hash_size=(32, 8), margin=8, max_distance=0.3, min_bits=16,
+                 max_shift=4, pixel_margin=0.25, max_changed=0.02, max_candidates=3):
+        """
+        :param max_size: number of text lines kept, the least recently used one is evicted first
+        :param hash_size: (w, h) of the dHash grid, text lines are long so the grid is wide
+        :param margin: gray level difference below which a gradient is ignored
+        :param max_distance: largest fraction of differing confident bits for two lines to be compared pixel by pixel
+        :param min_bits: lines with fewer confident bits in common never match, e.g. blank crops
+        :param max_shift: largest offset in pixels between two crops of the same line, covers the box jitter
+        :param pixel_margin: pixel difference, as a fraction of the line contrast, above which a pixel has changed
+        :param max_changed: largest fraction of changed pixels in any character-sized window for two lines to match
+        :param max_candidates: number of closest entries verified before giving up
+        """
+        self.max_size = max_size
+        self.hash_size = (int(hash_size[0]), int(hash_size[1]))
+        self.margin = margin
+        self.max_distance = max_distance
+        self.min_bits = min_bits
+        self.max_shift = max_shift
+        self.pixel_margin = int(round(pixel_margin * 255))
+        self.max_changed = max_changed
+        self.max_candidates = max_candidates
+        self._entries = OrderedDict()  # Fingerprint -> (normalized line pixels, result)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0  # Candidates the pixel check turned down
+        self.evictions = 0
+
+    def key(self, img):
+        """
+        Fingerprint of a text line image
+        :param img: BGR or gray text line image
+        :return: Fingerprint
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        w, h = self.hash_size
+        small = cv2.resize(gray, (w + 1, h), interpolation=cv2.INTER_AREA).astype(np.int16)
+        diff = small[:, 1:] - small[:, :-1]
+        # The hash grid hides the line length, keep lines of clearly different shapes apart
+        aspect = int(round(np.log2(img.shape[1] / img.shape[0]) * 4))
+        return Fingerprint(aspect, np.packbits(diff > 0).tobytes(), np.packbits(np.abs(diff) > self.margin).tobytes())
+
+    def get(self, key, img):
+        """
+        :param key: Fingerprint from key()
+        :param img: the text line image the key was computed from
+        :return: (result of the closest line that passes the pixel check or None, normalized pixels of img to pass to put)
+        """
+        pixels = self._normalize(img)
+        with self._lock:
+            for match in self._candidates(key):
+                if self._same_line(self._entries[match][0], pixels):
+                    self._entries.move_to_end(match)
+                    self.hits += 1
+                    return self._entries[match][1], pixels
+                self.rejected += 1
+            self.misses += 1
+            return None, pixels
+
+    def put(self, key, value, pixels):
+        """
+        :param pixels: normalized pixels of the line returned by get, kept for the pixel check of later lookups
+        """
+        with self._lock:
+            self._entries[key] = (pixels, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'rejected': self.rejected,
+                'evictions': self.evictions, 'hit_rate': round(self.hit_rate, 3)}
+
+    def _candidates(self, key):
+        """
+        Entries whose hash is within max_distance, closest first
+        """
+        candidates = [k for k in self._entries if abs(k.aspect - key.aspect) <= 1]
+        if not candidates:
+            return []
+        bits = np.frombuffer(b''.join(k.bits for k in candidates), dtype=np.uint8).reshape(len(candidates), -1)
+        confident = np.frombuffer(b''.join(k.confident for k in candidates), dtype=np.uint8).reshape(len(candidates), -1)
+        common = confident & np.frombuffer(key.confident, dtype=np.uint8)
+        differing = (bits ^ np.frombuffer(key.bits, dtype=np.uint8)) & common
+        counts = _POPCOUNT[common].sum(axis=1)
+        distances = _POPCOUNT[differing].sum(axis=1) / np.maximum(counts, 1)
+        distances[counts < self.min_bits] = np.inf
+        order = np.argsort(distances, kind='stable')[:self.max_candidates]
+        return [candidates[i] for i in order if distances[i] <= self.max_distance]
+
+    @staticmethod
+    def _normalize(img):
+        # Gray line stretched to the full range, so exposure changes between frames do not count as changes
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        gray = cv2.GaussianBlur(gray, (3, 3), 0)
+        cdf = np.cumsum(np.bincount(gray.ravel(), minlength=256))
+        low, high = np.searchsorted(cdf, (0.05 * cdf[-1], 0.95 * cdf[-1]))
+        lut = np.clip((np.arange(256) - low) * (255 / max(high - low, 1)), 0, 255).astype(np.uint8)
+        return cv2.LUT(gray, lut)
+
+    def _same_line(self, a, b):
+        """
+        Pixel check of two normalized line images, aligned by their projection profiles within max_shift
+        """
+        s = self.max_shift
+        if abs(a.shape[0] - b.shape[0]) > s or abs(a.shape[1] - b.shape[1]) > s:
+            return False
+        dx = self._profile_offset(_profile(a, 0), _profile(b, 0), s)
+        dy = self._profile_offset(_profile(a, 1), _profile(b, 1), s)
+        ay, ax, by, bx = max(0, dy), max(0, dx), max(0, -dy), max(0, -dx)
+        h, w = min(a.shape[0] - ay, b.shape[0] - by), min(a.shape[1] - ax, b.shape[1] - bx)
+        if h < 4 or w < 4:
+            return False
+        diff = cv2.absdiff(a[ay:ay + h, ax:ax + w], b[by:by + h, bx:bx + w])
+        # A changed character shows as a cluster of changed pixels in its window
+        changed = cv2.threshold(diff, self.pixel_margin, 255, cv2.THRESH_BINARY)[1]
+        window = (max(3, int(h * 0.3)), h)
+        return cv2.blur(changed, window, borderType=cv2.BORDER_REFLECT).max() <= self.max_changed * 255
+
+    @staticmethod
+    def _profile_offset(a, b, max_shift):
+        """
+        Offset d within max_shift that best lines up profile b[i] with a[i + d]
+        """
+        core = b[max_shift:len(b) - max_shift]
+        if len(core) < 4 or len(a) < len(core):
+            return 0
+        windows = np.lib.stride_tricks.sliding_window_view(a, len(core))[:2 * max_shift + 1]
+        return int(np.abs(windows - core).mean(axis=1).argmin()) - max_shift
@@ -0,0 +1,4 @@
+from .session_registry import SessionRegistry, ProviderPolicy, LazySession, registry, get_session
+from .model_cache import ModelCache
+from .bound_session import BoundSession
+from .profiling import Profiler, StageCounter, summarize_trace, profile_model
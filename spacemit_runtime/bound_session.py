@@ -0,0 +1,137 @@
+"""
+bound_session.py
+IOBinding execution mode: inputs are bound without copies and outputs are written into reusable buffers,
+so steady-state inference does not allocate per call.
+Fixed-shape outputs get one buffer each. Outputs whose shape depends on the input shape get buffers from a pool
+bucketed by power-of-two size, shared by all input shapes that fall into the same bucket. Outputs whose shape
+depends on the data (e.g. in-graph NMS) and string outputs are left to onnxruntime.
+
+The arrays returned by run() are only valid until the next run() of the same BoundSession.
+"""
+
+import threading
+import numpy as np
+
+# onnxruntime tensor type -> NumPy dtype of the outputs that can be bound to NumPy buffers
+_NUMPY_TYPES = {
+    'tensor(float)': np.float32, 'tensor(float16)': np.float16, 'tensor(double)': np.float64,
+    'tensor(int8)': np.int8, 'tensor(uint8)': np.uint8, 'tensor(int16)': np.int16, 'tensor(uint16)': np.uint16,
+    'tensor(int32)': np.int32, 'tensor(uint32)': np.uint32, 'tensor(int64)': np.int64, 'tensor(uint64)': np.uint64,
+    'tensor(bool)': np.bool_,
+}
+MIN_BUCKET_ELEMENTS = 1024
+MAX_SIGNATURES = 64
+
+
+def _is_static(shape):
+    return all(isinstance(d, int) and d > 0 for d in shape)
+
+
+class BoundSession:
+    def __init__(self, session):
+        """
+        :param session: InferenceSession (or LazySession) to run through IOBinding
+        """
+        self.session = session
+        self.input_names = [i.name for i in session.get_inputs()]
+        self.output_names = [o.name for o in session.get_outputs()]
+        self._output_types = {o.name: _NUMPY_TYPES.get(o.type) for o in session.get_outputs()}
+        # Outputs with a fully static shape never change, bind their buffers once
+        self._static_shapes = {o.name: tuple(o.shape) for o in session.get_outputs() if _is_static(o.shape)}
+        # With static inputs a dynamic output shape can only come from the data (e.g. in-graph NMS), never bind it
+        self._data_dependent = set()
+        if all(_is_static(i.shape) for i in session.get_inputs()):
+            self._data_dependent = {name for name in self.output_names if name not in self._static_shapes}
+        self._binding = session.io_binding()
+        self._signatures = {}  # input shapes -> {output name: shape, or None when the shape depends on the data}
+        self._pool = {}        # (output name, dtype, bucket) -> flat buffer
+        self._bound = None     # signature whose outputs are currently bound
+        self._views = {}       # output name -> array bound for the current signature
+        self._lock = threading.Lock()
+        self.allocated_bytes = 0
+
+    def __getattr__(self, name):
+        # get_inputs, get_outputs, get_providers ... of the wrapped session
+        return getattr(self.session, name)
+
+    def run(self, output_names, input_feed, run_options=None):
+        """
+        Same call as InferenceSession.run
+        :return: list of output arrays, reused by the next call
+        """
+        with self._lock:
+            # Keep the (usually unchanged) contiguous inputs referenced until the run is done
+            inputs = [np.ascontiguousarray(input_feed[name]) for name in self.input_names]
+            signature = tuple(x.shape for x in inputs)
+            for name, x in zip(self.input_names, inputs):
+                self._binding.bind_cpu_input(name, x)
+
+            if signature != self._bound:
+                self._bind_outputs(signature)
+            else:
+                # Outputs left to onnxruntime would keep the value of the previous run, whose shape may not fit
+                self._bind_unbound_outputs()
+            try:
+                self.session.run_with_iobinding(self._binding, run_options)
+            except Exception:
+                if signature not in self._signatures or not self._views:
+                    raise
+                # An output shape depends on the data, let onnxruntime allocate the outputs for this input shape
+                self._signatures[signature] = {name: None for name in self.output_names}
+                self._bind_outputs(signature)
+                self.session.run_with_iobinding(self._binding, run_options)
+
+            outputs = self._collect(signature)
+            names = output_names or self.output_names
+            return [outputs[name] for name in names]
+
+    def _bind_outputs(self, signature):
+        shapes = self._signatures.get(signature, {})
+        self._views = {}
+        for name in self.output_names:
+            shape = self._static_shapes.get(name, shapes.get(name))
+            dtype = self._output_types[name]
+            if shape is None or dtype is None:
+                self._binding.bind_output(name)
+                continue
+            view = self._buffer(name, dtype, shape)
+            self._binding.bind_output(name, 'cpu', 0, dtype, view.shape, view.ctypes.data)
+            self._views[name] = view
+        self._bound = signature
+
+    def _bind_unbound_outputs(self):
+        for name in self.output_names:
+            if name not in self._views:
+                self._binding.bind_output(name)
+
+    def _buffer(self, name, dtype, shape):
+        size = int(np.prod(shape))
+        if name in self._static_shapes:
+            bucket = size
+        else:
+            bucket = max(MIN_BUCKET_ELEMENTS, 1 << (size - 1).bit_length())
+        key = (name, dtype, bucket)
+        buffer = self._pool.get(key)
+        if buffer is None:
+            buffer = np.empty(bucket, dtype=dtype)
+            self._pool[key] = buffer
+            self.allocated_bytes += buffer.nbytes
+        return buffer[:size].reshape(shape)
+
+    def _collect(self, signature):
+        unbound = [name for name in self.output_names if name not in self._views]
+        outputs = dict(self._views)
+        if unbound:
+            values = self._binding.get_outputs()
+            for name, value in zip(self.output_names, values):
+                if name in unbound:
+                    outputs[name] = value.numpy()
+
+        if signature not in self._signatures:
+            # First run with these input shapes: remember the output shapes, later runs reuse bucketed buffers
+            if len(self._signatures) >= MAX_SIGNATURES:
+                self._signatures.clear()
+            self._signatures[signature] = {name: outputs[name].shape for name in self.output_names
+                                           if self._output_types[name] is not None and name not in self._data_dependent}
+            self._bound = None
+        return outputs
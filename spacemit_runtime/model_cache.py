@@ -0,0 +1,134 @@
+"""
+model_cache.py
+On-disk cache of optimized models, so graph optimization runs once per model instead of on every process start.
+Entries are keyed by the model file (location, size, modification time), onnxruntime version, machine, providers
+and session options, so any change to one of them produces a new entry. The file name carries a digest of the configuration (machine,
+providers, session options) separately, so when the model or onnxruntime changes only the entries of the same
+configuration are removed, and a model loaded under several configurations keeps one entry per configuration.
+Configurations whose optimized graph cannot be written (e.g. providers with compiled nodes) leave a marker file instead
+of an entry, so later processes load them without the cache straight away.
+
+Environment variables:
+    SPACEMIT_ORT_CACHE          0 disables the cache, default 1
+    SPACEMIT_ORT_CACHE_DIR      cache directory, default ~/.cache/spacemit_ort
+    SPACEMIT_ORT_CACHE_FORMAT   onnx (optimized ONNX graph, default) or ort (ORT format)
+"""
+
+import os
+import glob
+import hashlib
+import platform
+import onnxruntime as ort
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "spacemit_ort")
+
+
+class ModelCache:
+    def __init__(self, cache_dir=None, fmt=None, enabled=None):
+        """
+        :param cache_dir: directory the optimized models are written to
+        :param fmt: 'onnx' or 'ort'
+        :param enabled: False to bypass the cache
+        """
+        self.cache_dir = cache_dir or os.environ.get('SPACEMIT_ORT_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.fmt = (fmt or os.environ.get('SPACEMIT_ORT_CACHE_FORMAT', 'onnx')).lower()
+        if self.fmt not in ('onnx', 'ort'):
+            raise ValueError(f"Unsupported cache format: {self.fmt}")
+        self.enabled = enabled if enabled is not None else os.environ.get('SPACEMIT_ORT_CACHE', '1') != '0'
+        self.hits = 0
+        self.misses = 0
+        self._failed = set()  # Entries whose configuration cannot be cached
+
+    def key(self, model_path, providers, options):
+        """
+        Cache key of one model / configuration
+        :param providers: resolved provider list
+        :param options: session options that influence the optimized graph
+        :return: '<configuration digest>-<model and runtime digest>'
+        """
+        config = hashlib.sha256(repr((platform.machine(), self.fmt, providers,
+                                      sorted((k, str(v)) for k, v in options.items()))).encode())
+        # The model file is identified by its location, size and modification time instead of hashing its content,
+        # so a lookup costs one stat call even for large models
+        stat = os.stat(os.path.realpath(model_path))
+        content = hashlib.sha256(repr((stat.st_size, stat.st_mtime_ns, ort.__version__)).encode())
+        return f"{config.hexdigest()[:8]}-{content.hexdigest()[:16]}"
+
+    def path(self, model_path, key):
+        return os.path.join(self.cache_dir, f"{self._prefix(model_path)}-{key}.{self.fmt}")
+
+    def lookup(self, model_path, providers, options):
+        """
+        :return: (cached model path or None, path a new entry should be written to)
+        """
+        target = self.path(model_path, self.key(model_path, providers, options))
+        if os.path.exists(target):
+            self.hits += 1
+            return target, target
+        self.misses += 1
+        return None, target
+
+    def prepare(self, sess_options, target):
+        """
+        Let the session being created write its optimized graph to a temporary file next to target
+        :return: temporary path, pass it to commit once the session was created
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        sess_options.optimized_model_filepath = tmp_path
+        if self.fmt == 'ort':
+            sess_options.add_session_config_entry('session.save_model_format', 'ORT')
+        return tmp_path
+
+    def commit(self, tmp_path, target):
+        """
+        Publish a freshly written entry and drop older entries of the same model and configuration,
+        entries of the same model under other providers or session options are kept
+        """
+        if not os.path.exists(tmp_path):
+            return
+        os.replace(tmp_path, target)
+        self._remove_stale(target)
+
+    def failed(self, target):
+        """
+        :return: True when the configuration of target could not be cached before, in this process or an earlier one
+        """
+        if target in self._failed:
+            return True
+        if os.path.exists(f"{target}.failed"):
+            self._failed.add(target)
+            return True
+        return False
+
+    def mark_failed(self, target):
+        """
+        Remember that the configuration of target cannot be cached, until the model or onnxruntime changes
+        """
+        self._failed.add(target)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        open(f"{target}.failed", 'w').close()
+        self._remove_stale(target)
+
+    def _remove_stale(self, target):
+        # <prefix>-<config>-<content>.<fmt>[.failed]: only the model / runtime digest may differ
+        stem = target[:-(len(self.fmt) + 1)].rsplit('-', 1)[0]
+        for suffix in ('', '.failed'):
+            for stale in glob.glob(f"{glob.escape(stem)}-*.{self.fmt}{suffix}"):
+                if stale != f"{target}{suffix}":
+                    os.remove(stale)
+
+    def discard(self, tmp_path):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    def clear(self):
+        for entry in glob.glob(os.path.join(glob.escape(self.cache_dir), "*")):
+            os.remove(entry)
+
+    @staticmethod
+    def _prefix(model_path):
+        # Model file name plus a short hash of its location, so models with the same name do not evict each other
+        real_path = os.path.realpath(model_path)
+        name = os.path.splitext(os.path.basename(real_path))[0]
+        return f"{name}-{hashlib.sha1(real_path.encode()).hexdigest()[:8]}"
@@ -0,0 +1,197 @@
+"""
+profiling.py
+Per-operator ONNX Runtime profiling of every session created through the registry, summarized into a top-N
+operator table per model. Disabled by default, in which case sessions are created exactly as without it.
+Also holds StageCounter, the frame counter the threaded detection and OCR pipelines report their FPS with.
+
+Environment variables:
+    SPACEMIT_ORT_PROFILE        1 enables profiling of all sessions and prints the summary when the process exits
+    SPACEMIT_ORT_PROFILE_DIR    directory the onnxruntime traces are written to, default ./ort_profiles
+    SPACEMIT_ORT_PROFILE_TOP    number of operator types listed per model, default 10
+
+Usage:
+    SPACEMIT_ORT_PROFILE=1 python cv_robot_arm_demo.py
+    python -m spacemit_runtime.profiling ort_profiles/yolov8n.q_*.json ort_profiles/best_*.json
+    python -m spacemit_runtime.profiling --models spacemit_cv/yolov8n.q.onnx spacemit_cv/best.onnx --runs 20 \
+        --providers SpaceMITExecutionProvider CPUExecutionProvider
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import defaultdict, deque
+import numpy as np
+
+DEFAULT_PROFILE_DIR = "ort_profiles"
+
+
+class Profiler:
+    def __init__(self, enabled=None, profile_dir=None, top_n=None):
+        """
+        :param enabled: profile sessions created from now on
+        :param profile_dir: directory the traces are written to
+        :param top_n: default number of operator types per model in the summary
+        """
+        self.enabled = enabled if enabled is not None else os.environ.get('SPACEMIT_ORT_PROFILE', '0') == '1'
+        self.profile_dir = profile_dir or os.environ.get('SPACEMIT_ORT_PROFILE_DIR', DEFAULT_PROFILE_DIR)
+        self.top_n = top_n or int(os.environ.get('SPACEMIT_ORT_PROFILE_TOP', 10))
+
+    def apply(self, sess_options, model_path):
+        """
+        Turn on profiling in the SessionOptions of a model, traces are named after the model file
+        """
+        os.makedirs(self.profile_dir, exist_ok=True)
+        sess_options.enable_profiling = True
+        sess_options.profile_file_prefix = os.path.join(self.profile_dir, os.path.splitext(os.path.basename(model_path))[0])
+
+
+class StageCounter:
+    def __init__(self, window=30):
+        """
+        Frame counter of one pipeline stage
+        :param window: number of recent frames the FPS is averaged over
+        """
+        self.count = 0
+        self._stamps = deque(maxlen=window)
+
+    def tick(self):
+        self.count += 1
+        self._stamps.append(time.perf_counter())
+
+    @property
+    def fps(self):
+        if len(self._stamps) < 2:
+            return 0.0
+        span = self._stamps[-1] - self._stamps[0]
+        return (len(self._stamps) - 1) / span if span > 0 else 0.0
+
+
+def summarize_trace(trace_path, top_n=10, model=None, skip_runs=0):
+    """
+    Aggregate an onnxruntime profiling trace by operator type
+    :param trace_path: JSON trace written by InferenceSession.end_profiling()
+    :param top_n: number of operator types kept, None for all
+    :param model: model name reported, defaults to the trace file name
+    :param skip_runs: leave out the first runs, e.g. warm-up
+    :return: dict with the number of runs, mean run time and the operators sorted by total time
+    """
+    with open(trace_path) as f:
+        events = json.load(f)
+
+    if skip_runs:
+        runs = sorted((e for e in events if e.get('cat') == 'Session' and e.get('name') == 'model_run'), key=lambda e: e['ts'])
+        if runs:
+            cutoff = runs[min(skip_runs, len(runs)) - 1]
+            cutoff = cutoff['ts'] + cutoff['dur']
+            events = [e for e in events if e.get('ts', 0) >= cutoff]
+
+    ops = defaultdict(lambda: {'time_us': 0, 'calls': 0, 'providers': set()})
+    run_times = []
+    for event in events:
+        if event.get('cat') == 'Session' and event.get('name') == 'model_run':
+            run_times.append(event['dur'])
+        elif event.get('cat') == 'Node' and event.get('name', '').endswith('_kernel_time'):
+            args = event.get('args', {})
+            op = ops[args.get('op_name', '?')]
+            op['time_us'] += event['dur']
+            op['calls'] += 1
+            op['providers'].add(args.get('provider', '?'))
+
+    total = sum(op['time_us'] for op in ops.values())
+    rows = [{'op': name, 'time_ms': round(op['time_us'] / 1000, 3), 'calls': op['calls'],
+             'share': round(op['time_us'] / total, 4) if total else 0.0, 'providers': sorted(op['providers'])}
+            for name, op in sorted(ops.items(), key=lambda item: -item[1]['time_us'])]
+    return {
+        'model': model or os.path.basename(trace_path),
+        'trace': trace_path,
+        'runs': len(run_times),
+        'mean_run_ms': round(float(np.mean(run_times)) / 1000, 3) if run_times else None,
+        'kernel_time_ms': round(total / 1000, 3),
+        'ops': rows[:top_n] if top_n else rows,
+    }
+
+
+def print_summary(summary, file=None):
+    file = file or sys.stdout
+    mean_run = f"{summary['mean_run_ms']:.3f} ms" if summary['mean_run_ms'] is not None else '-'
+    print(f"{summary['model']}  runs {summary['runs']}  mean run {mean_run}  kernel time {summary['kernel_time_ms']:.3f} ms",
+          file=file)
+    print(f"{'op':<24} {'total ms':>10} {'calls':>7} {'share':>7}  provider", file=file)
+    for row in summary['ops']:
+        print(f"{row['op']:<24} {row['time_ms']:>10.3f} {row['calls']:>7} {row['share'] * 100:>6.1f}%  "
+              f"{','.join(p.replace('ExecutionProvider', '') for p in row['providers'])}", file=file)
+
+
+def _random_feed(session, shape=None):
+    """
+    Random inputs matching the session signature, dynamic dimensions set to 1 unless shape is given for the first input
+    """
+    feed = {}
+    for i, model_input in enumerate(session.get_inputs()):
+        if i == 0 and shape:
+            dims = shape
+        else:
+            dims = [d if isinstance(d, int) and d > 0 else 1 for d in model_input.shape]
+        if model_input.type == 'tensor(uint8)':
+            feed[model_input.name] = np.random.randint(0, 256, dims, dtype=np.uint8)
+        elif model_input.type in ('tensor(int32)', 'tensor(int64)'):
+            feed[model_input.name] = np.ones(dims, dtype=np.int32 if model_input.type == 'tensor(int32)' else np.int64)
+        else:
+            feed[model_input.name] = np.random.rand(*dims).astype(np.float32)
+    return feed
+
+
+def profile_model(model_path, providers=None, runs=20, warmup=3, shape=None, top_n=10, profile_dir=None):
+    """
+    Profile a model on random inputs with one provider list
+    :param providers: provider list, None for the registry policy
+    :param runs: number of profiled runs after the warm-up runs
+    :param shape: shape of the first input, needed for models with dynamic spatial dimensions
+    :return: summary of summarize_trace, with the providers actually used
+    """
+    from .session_registry import SessionRegistry, ProviderPolicy
+
+    registry = SessionRegistry(ProviderPolicy(providers), profiler=Profiler(True, profile_dir))
+    session = registry.get_session(model_path, use_cache=False)
+    feed = _random_feed(session, shape)
+    for _ in range(warmup + runs):
+        session.run(None, feed)
+    summary = registry.profile_report(top_n, skip_runs=warmup)[0]
+    summary['providers'] = session.get_providers()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize onnxruntime profiling traces per operator type')
+    parser.add_argument('traces', nargs='*', help='Trace files written with SPACEMIT_ORT_PROFILE=1')
+    parser.add_argument('--models', type=str, nargs='*', default=[], help='Profile these models on random inputs')
+    parser.add_argument('--providers', type=str, nargs='*', default=None,
+                        help='Providers to compare, each model is profiled once per provider (with CPU fallback)')
+    parser.add_argument('--runs', type=int, default=20, help='Number of profiled runs per model')
+    parser.add_argument('--shape', type=str, default=None, help='Shape of the first input, e.g. 1,3,320,320')
+    parser.add_argument('--top', type=int, default=10, help='Number of operator types listed per model')
+    parser.add_argument('--json', type=str, default=None, help='Also write the summaries as JSON to this file')
+    args = parser.parse_args()
+    if not args.traces and not args.models:
+        parser.error('give trace files or --models')
+
+    summaries = [summarize_trace(path, args.top) for path in args.traces]
+    shape = [int(d) for d in args.shape.split(',')] if args.shape else None
+    for model_path in args.models:
+        for provider in (args.providers or [None]):
+            summary = profile_model(model_path, [provider] if provider else None, args.runs, shape=shape, top_n=args.top)
+            summary['model'] = f"{os.path.basename(model_path)} [{summary['providers'][0]}]"
+            summaries.append(summary)
+
+    for summary in summaries:
+        print_summary(summary)
+        print()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summaries, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+"""
+session_registry.py
+Central registry for ONNX Runtime sessions.
+Every model in the project (detection, OCR, ASR, tokenizer) is loaded through here, so identical loads are shared,
+one provider policy with CPU fallback applies everywhere, and load time / memory of each session can be reported.
+
+Environment variables:
+    SPACEMIT_ORT_PROVIDERS  comma separated provider preference, default "SpaceMITExecutionProvider,CPUExecutionProvider"
+    SPACEMIT_ORT_THREADS    default intra-op thread count, default 4
+    SPACEMIT_ORT_IOBINDING  1 to run sessions through IOBinding with reusable output buffers by default
+    SPACEMIT_ORT_CACHE*     optimized-model cache, see model_cache.py
+    SPACEMIT_ORT_PROFILE*   per-operator profiling, see profiling.py
+"""
+
+import os
+import sys
+import time
+import atexit
+import threading
+import warnings
+import onnxruntime as ort
+from .model_cache import ModelCache
+from .bound_session import BoundSession
+from .profiling import Profiler, summarize_trace, print_summary
+
+try:
+    import spacemit_ort  # Registers SpaceMITExecutionProvider
+except ImportError:
+    spacemit_ort = None
+
+CPU_PROVIDER = "CPUExecutionProvider"
+DEFAULT_PROVIDERS = ("SpaceMITExecutionProvider", CPU_PROVIDER)
+DEFAULT_THREADS = 4
+
+# SessionOptions attributes that can be passed to get_session as keyword arguments
+_OPTION_NAMES = ('inter_op_num_threads', 'graph_optimization_level', 'execution_mode', 'enable_cpu_mem_arena',
+                 'enable_mem_pattern', 'log_severity_level', 'optimized_model_filepath')
+
+
+class ProviderPolicy:
+    def __init__(self, providers=None, intra_op_num_threads=None, io_binding=None):
+        """
+        Provider preference and defaults shared by all sessions
+        :param providers: preferred providers in order, unavailable ones are skipped and CPU is always the last resort
+        :param intra_op_num_threads: default intra-op thread count
+        :param io_binding: hand out BoundSessions by default
+        """
+        if providers is None:
+            env = os.environ.get('SPACEMIT_ORT_PROVIDERS')
+            providers = [p.strip() for p in env.split(',') if p.strip()] if env else DEFAULT_PROVIDERS
+        if intra_op_num_threads is None:
+            intra_op_num_threads = int(os.environ.get('SPACEMIT_ORT_THREADS', DEFAULT_THREADS))
+        if io_binding is None:
+            io_binding = os.environ.get('SPACEMIT_ORT_IOBINDING', '0') == '1'
+        self.providers = tuple(providers)
+        self.intra_op_num_threads = intra_op_num_threads
+        self.io_binding = io_binding
+
+    def resolve(self, providers=None):
+        """
+        Filter a provider list down to what this onnxruntime build offers
+        :param providers: explicit providers (names or (name, options) tuples), None for the policy default
+        :return: list usable as InferenceSession(providers=...)
+        """
+        available = set(ort.get_available_providers())
+        resolved = []
+        for provider in (providers if providers is not None else self.providers):
+            name = provider[0] if isinstance(provider, tuple) else provider
+            if name in available and name not in [_provider_name(p) for p in resolved]:
+                resolved.append(provider)
+        if CPU_PROVIDER not in [_provider_name(p) for p in resolved]:
+            resolved.append(CPU_PROVIDER)
+        return resolved
+
+
+class SessionRecord:
+    def __init__(self, model_path, providers, load_time, memory_bytes, cache=None):
+        self.model_path = model_path
+        self.providers = providers
+        self.cache = cache                # 'hit', 'miss' or None when the optimized-model cache was not used
+        self.load_time = load_time        # Seconds spent in InferenceSession()
+        self.memory_bytes = memory_bytes  # Resident memory growth while loading
+        self.users = 1                    # Number of get_session calls sharing this session
+        self.profiled = False             # Created with onnxruntime profiling enabled
+        self.profile_path = None          # Trace file, once profiling has been ended
+
+    def asdict(self):
+        return {'model': self.model_path, 'providers': self.providers, 'load_time_ms': round(self.load_time * 1000, 1),
+                'memory_mb': round(self.memory_bytes / 2 ** 20, 1), 'users': self.users, 'cache': self.cache}
+
+
+class LazySession:
+    def __init__(self, registry, key, loader, wrap=None):
+        """
+        Stand-in that loads the real session on first use
+        :param wrap: optional callable applied to the loaded session, e.g. BoundSession
+        """
+        self._registry = registry
+        self._key = key
+        self._loader = loader
+        self._wrap = wrap
+        self._session = None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            session = self._registry._load(self._key, self._loader)
+            self._session = self._wrap(session) if self._wrap else session
+        return getattr(self._session, name)
+
+
+class SessionRegistry:
+    def __init__(self, policy=None, cache=None, profiler=None):
+        self.policy = policy or ProviderPolicy()
+        self.cache = cache or ModelCache()
+        self.profiler = profiler or Profiler()
+        self._sessions = {}  # key -> InferenceSession
+        self._records = {}   # key -> SessionRecord
+        self._lock = threading.RLock()
+
+    def configure(self, providers=None, intra_op_num_threads=None, io_binding=None, profiling=None):
+        """
+        Change the default provider policy for sessions created afterwards
+        :param profiling: True to profile sessions created afterwards, see profile_report()
+        """
+        if profiling is not None:
+            self.profiler.enabled = profiling
+        self.policy = ProviderPolicy(providers if providers is not None else self.policy.providers,
+                                     intra_op_num_threads if intra_op_num_threads is not None else self.policy.intra_op_num_threads,
+                                     io_binding if io_binding is not None else self.policy.io_binding)
+
+    def get_session(self, model_path, providers=None, intra_op_num_threads=None, custom_ops_libraries=(), lazy=False,
+                    use_cache=True, io_binding=None, **options):
+        """
+        Return a shared InferenceSession for a model, loading it only once per configuration
+        :param model_path: path to the .onnx model
+        :param providers: explicit provider list, None for the policy default
+        :param intra_op_num_threads: None for the policy default
+        :param custom_ops_libraries: shared libraries with custom operators to register
+        :param lazy: return a LazySession that loads on first use
+        :param use_cache: load the optimized graph from the on-disk cache, writing it on the first load
+        :param io_binding: return a BoundSession of its own around the shared session, None for the policy default
+        :param options: other SessionOptions attributes, e.g. graph_optimization_level
+        :return: InferenceSession (or LazySession / BoundSession)
+        """
+        unknown = set(options) - set(_OPTION_NAMES)
+        if unknown:
+            raise TypeError(f"Unsupported session options: {sorted(unknown)}")
+
+        providers = self.policy.resolve(providers)
+        threads = intra_op_num_threads if intra_op_num_threads is not None else self.policy.intra_op_num_threads
+        # A caller that writes its own optimized model (OrtInferSession) keeps doing so
+        use_cache = use_cache and 'optimized_model_filepath' not in options
+        profiling = self.profiler.enabled
+        # Profiled sessions are not shared with unprofiled ones
+        key = (os.path.realpath(model_path), _freeze(providers), threads, tuple(custom_ops_libraries), _freeze(options),
+               profiling)
+
+        def loader():
+            return self._create(model_path, providers, threads, custom_ops_libraries, options, use_cache, profiling)
+
+        if io_binding is None:
+            io_binding = self.policy.io_binding
+        # Output buffers belong to one caller, so every caller gets its own binding around the shared session
+        wrap = BoundSession if io_binding else None
+
+        with self._lock:
+            if key in self._sessions:
+                self._records[key].users += 1
+                session = self._sessions[key]
+                return wrap(session) if wrap else session
+        if lazy:
+            return LazySession(self, key, loader, wrap)
+        session = self._load(key, loader)
+        return wrap(session) if wrap else session
+
+    def report(self):
+        """
+        Load time, memory and providers of every session loaded so far
+        """
+        with self._lock:
+            return [record.asdict() for record in self._records.values()]
+
+    def print_report(self):
+        for row in self.report():
+            print(f"{os.path.basename(row['model']):<40} {row['load_time_ms']:>9.1f} ms {row['memory_mb']:>7.1f} MB "
+                  f"x{row['users']}  {row['cache'] or '-':<4}  {','.join(row['providers'])}")
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._records.clear()
+
+    def profile_report(self, top_n=None, skip_runs=0):
+        """
+        End profiling of every profiled session and summarize its trace by operator type.
+        Sessions keep running afterwards, without profiling.
+        :param top_n: number of operator types per model, None for the profiler default
+        :param skip_runs: leave out the first runs of each session, e.g. warm-up
+        :return: list of summaries, see profiling.summarize_trace
+        """
+        summaries = []
+        with self._lock:
+            items = [(key, self._sessions[key], record) for key, record in self._records.items() if record.profiled]
+        for key, session, record in items:
+            if record.profile_path is None:
+                record.profile_path = session.end_profiling() or ''
+            if record.profile_path:
+                summary = summarize_trace(record.profile_path, top_n or self.profiler.top_n,
+                                          os.path.basename(record.model_path), skip_runs)
+                summary['providers'] = record.providers
+                summaries.append(summary)
+        return summaries
+
+    def print_profile(self, top_n=None, file=None):
+        for summary in self.profile_report(top_n):
+            print_summary(summary, file)
+            print(file=file)
+
+    def _load(self, key, loader):
+        with self._lock:
+            if key in self._sessions:
+                return self._sessions[key]
+            rss_before = _resident_bytes()
+            start = time.perf_counter()
+            session, cache_state = loader()
+            load_time = time.perf_counter() - start
+            self._sessions[key] = session
+            record = SessionRecord(key[0], session.get_providers(), load_time,
+                                   max(0, _resident_bytes() - rss_before), cache_state)
+            record.profiled = key[-1]
+            self._records[key] = record
+            return session
+
+    def _create(self, model_path, providers, threads, custom_ops_libraries, options, use_cache=True, profiling=False):
+        def make_options():
+            sess_options = ort.SessionOptions()
+            sess_options.intra_op_num_threads = threads
+            for name, value in options.items():
+                setattr(sess_options, name, value)
+            for library in custom_ops_libraries:
+                sess_options.register_custom_ops_library(library)
+            if profiling:
+                self.profiler.apply(sess_options, model_path)
+            return sess_options
+
+        if use_cache and self.cache.enabled:
+            session, cache_state = self._create_cached(model_path, providers, options, make_options)
+            if session is not None:
+                return session, cache_state
+
+        sess_options = make_options()
+        try:
+            return ort.InferenceSession(model_path, sess_options=sess_options, providers=providers), None
+        except Exception as e:
+            if [_provider_name(p) for p in providers] == [CPU_PROVIDER]:
+                raise
+            # The accelerator could not take this model, run it on the CPU instead
+            warnings.warn(f"Failed to load {model_path} with {[_provider_name(p) for p in providers]} ({e}), falling back to {CPU_PROVIDER}",
+                          RuntimeWarning)
+            return ort.InferenceSession(model_path, sess_options=sess_options, providers=[CPU_PROVIDER]), None
+
+    def _create_cached(self, model_path, providers, options, make_options):
+        """
+        Load the optimized graph from the cache, or optimize the model and store the result
+        :return: (session or None when the cache cannot be used, 'hit' / 'miss')
+        """
+        try:
+            cached_path, target = self.cache.lookup(model_path, _freeze(providers), options)
+        except OSError:
+            return None, None
+        if cached_path is None and self.cache.failed(target):
+            return None, None
+
+        if cached_path is not None:
+            sess_options = make_options()
+            # The graph is already optimized, skip the optimizers on load
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            try:
+                return ort.InferenceSession(cached_path, sess_options=sess_options, providers=providers), 'hit'
+            except Exception as e:
+                warnings.warn(f"Ignoring unusable cached model {cached_path} ({e})", RuntimeWarning)
+                os.remove(cached_path)
+
+        sess_options = make_options()
+        try:
+            tmp_path = self.cache.prepare(sess_options, target)
+        except OSError:
+            return None, None
+        try:
+            session = ort.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+        except Exception:
+            # e.g. providers with compiled nodes cannot serialize their graph, load without the cache from now on
+            self.cache.discard(tmp_path)
+            try:
+                self.cache.mark_failed(target)
+            except OSError:
+                pass
+            return None, None
+        try:
+            self.cache.commit(tmp_path, target)
+        except OSError:
+            self.cache.discard(tmp_path)
+        return session, 'miss'
+
+
+def _provider_name(provider):
+    return provider[0] if isinstance(provider, tuple) else provider
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _resident_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+registry = SessionRegistry()
+
+
+@atexit.register
+def _print_profile_at_exit():
+    # Enabled through SPACEMIT_ORT_PROFILE, the demos print their operator tables without code changes
+    if registry.profiler.enabled:
+        registry.print_profile(file=sys.stderr)
+
+
+def get_session(model_path, **kwargs):
+    """
+    Shortcut for registry.get_session on the process-wide registry
+    """
+    return registry.get_session(model_path, **kwargs)
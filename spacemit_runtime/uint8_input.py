@@ -0,0 +1,118 @@
+"""
+uint8_input.py
+Fold input normalization and the HWC -> CHW transpose into an ONNX model, so it takes raw uint8 [N, H, W, 3] BGR frames.
+The Python wrappers (ElephantDetection, TextDetector, TextClassifier, TextRecognizer) detect a tensor(uint8) input
+and hand the frame buffer to the session without the float conversion.
+
+Usage:
+    python -m spacemit_runtime.uint8_input --model spacemit_cv/yolov8n.q.onnx --preset yolo
+    python -m spacemit_runtime.uint8_input --model spacemit_orc/models/ppocr3_det_fixed.onnx --preset ppocr_det
+"""
+
+import argparse
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+
+# model input = (pixel * scale - mean) / std per channel, bgr_to_rgb reverses the channels of the BGR frame first
+PRESETS = {
+    'yolo': dict(scale=1 / 255, mean=(0, 0, 0), std=(1, 1, 1), bgr_to_rgb=True),
+    'ppocr_det': dict(scale=1 / 255, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), bgr_to_rgb=False),
+    'ppocr_rec': dict(scale=1, mean=(127.5, 127.5, 127.5), std=(127.5, 127.5, 127.5), bgr_to_rgb=False),
+    'ppocr_cls': dict(scale=1, mean=(127.5, 127.5, 127.5), std=(127.5, 127.5, 127.5), bgr_to_rgb=False),
+}
+
+
+def fold_uint8_input(model, scale, mean, std, bgr_to_rgb=False):
+    """
+    Replace the float NCHW input of a model by a uint8 NHWC one, in place
+    :param model: onnx.ModelProto with a single float [N, 3, H, W] input
+    :param scale: factor applied to the raw pixel values, e.g. 1 / 255
+    :param mean: per channel mean subtracted after scaling
+    :param std: per channel std divided by after subtracting the mean
+    :param bgr_to_rgb: reverse the channel order of the frame
+    :return: the model
+    """
+    graph = model.graph
+    initializers = {init.name for init in graph.initializer}
+    inputs = [i for i in graph.input if i.name not in initializers]
+    if len(inputs) != 1:
+        raise ValueError(f"Expected a single image input, got {[i.name for i in inputs]}")
+    image_input = inputs[0]
+    if image_input.type.tensor_type.elem_type != TensorProto.FLOAT:
+        raise ValueError(f"Input {image_input.name} is not float, the model may already take uint8")
+    dims = image_input.type.tensor_type.shape.dim
+    if len(dims) != 4 or dims[1].dim_value not in (0, 3):
+        raise ValueError(f"Expected an [N, 3, H, W] input, got {[d.dim_value or d.dim_param for d in dims]}")
+
+    name = image_input.name
+    normalized = f"{name}_normalized"
+    # The old input name now carries the normalized tensor
+    for node in graph.node:
+        for i, node_input in enumerate(node.input):
+            if node_input == name:
+                node.input[i] = normalized
+
+    # (pixel * scale - mean) / std == pixel * a + b
+    std = np.asarray(std, dtype=np.float64)
+    a = (scale / std).astype(np.float32).reshape(1, 3, 1, 1)
+    b = (-np.asarray(mean, dtype=np.float64) / std).astype(np.float32).reshape(1, 3, 1, 1)
+    graph.initializer.extend([numpy_helper.from_array(a, f"{name}_scale"), numpy_helper.from_array(b, f"{name}_bias")])
+
+    nodes = []
+    pixels = name
+    if bgr_to_rgb:
+        graph.initializer.append(numpy_helper.from_array(np.array([2, 1, 0], dtype=np.int64), f"{name}_rgb_order"))
+        nodes.append(helper.make_node('Gather', [pixels, f"{name}_rgb_order"], [f"{name}_rgb"], name=f"{name}_rgb", axis=3))
+        pixels = f"{name}_rgb"
+    # Transpose while still uint8, a quarter of the bytes of the float tensor
+    nodes += [
+        helper.make_node('Transpose', [pixels], [f"{name}_nchw"], name=f"{name}_nchw", perm=[0, 3, 1, 2]),
+        helper.make_node('Cast', [f"{name}_nchw"], [f"{name}_float"], name=f"{name}_float", to=TensorProto.FLOAT),
+        helper.make_node('Mul', [f"{name}_float", f"{name}_scale"], [f"{name}_scaled"], name=f"{name}_scaled"),
+        helper.make_node('Add', [f"{name}_scaled", f"{name}_bias"], [normalized], name=normalized),
+    ]
+    # Prepend so the graph stays topologically sorted
+    existing = list(graph.node)
+    del graph.node[:]
+    graph.node.extend(nodes + existing)
+
+    nhwc = [dims[0], dims[2], dims[3], dims[1]]
+    new_input = helper.make_tensor_value_info(name, TensorProto.UINT8, [d.dim_value or d.dim_param or None for d in nhwc])
+    new_input.type.tensor_type.shape.dim[3].dim_value = 3
+    graph.input.remove(image_input)
+    graph.input.insert(0, new_input)
+    return model
+
+
+def convert(model_path, output_path, **kwargs):
+    model = fold_uint8_input(onnx.load(model_path), **kwargs)
+    onnx.checker.check_model(model)
+    onnx.save(model, output_path)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Make an ONNX model take uint8 HWC frames')
+    parser.add_argument('--model', type=str, required=True, help='Path to the float-input ONNX model')
+    parser.add_argument('--output', type=str, default=None, help='Path of the new model, defaults to <model>.u8.onnx')
+    parser.add_argument('--preset', type=str, choices=sorted(PRESETS), default=None, help='Normalization of a known model')
+    parser.add_argument('--scale', type=float, default=None, help='Pixel scale, e.g. 0.00392156862745098 for 1/255')
+    parser.add_argument('--mean', type=float, nargs=3, default=None, help='Per channel mean after scaling')
+    parser.add_argument('--std', type=float, nargs=3, default=None, help='Per channel std after scaling')
+    parser.add_argument('--bgr-to-rgb', action='store_true', help='Reverse the channel order of the BGR frame')
+    args = parser.parse_args()
+
+    options = dict(PRESETS[args.preset]) if args.preset else dict(scale=1.0, mean=(0, 0, 0), std=(1, 1, 1), bgr_to_rgb=False)
+    for key in ('scale', 'mean', 'std'):
+        if getattr(args, key) is not None:
+            options[key] = getattr(args, key)
+    options['bgr_to_rgb'] = options['bgr_to_rgb'] or args.bgr_to_rgb
+
+    output = args.output or args.model.replace('.onnx', '.u8.onnx')
+    convert(args.model, output, **options)
+    print(f"uint8-input model written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -12,16 +12,28 @@ import threading
 lock = threading.Lock()
 
 
-def grab_an_object_and_place_it_in_a_position(object_name, latest_frame, motion_control, detector):
+def grab_an_object_and_place_it_in_a_position(object_name, latest_frame, motion_control, detector, tracker=None):
     """Grab an object
     Args:
         object_name: The category of the object selected by the user
         latest_frame: The latest video frame
         motion_control: Robotic arm control class
         detector: Object recognition detector
+        tracker: Optional ByteTracker fed by the display loop, its live track table is used instead of a new inference
 
     """
     print("ok")
+    # Look the target up in the live track table first
+    if tracker is not None:
+        track = tracker.find(object_name)
+        if track is not None:
+            center_x, center_y = track.center
+            print(f"Found the target {object_name} (track {track.track_id}), center point: ({center_x:.1f}, {center_y:.1f})")
+
+            # Execute the crawl
+            motion_control.convert_to_real_coordinates(center_x, center_y)
+            return f"✅ Crawled {object_name} "
+
     # Get the latest frame
     with lock:
         if latest_frame is None:
@@ -29,24 +41,27 @@ def grab_an_object_and_place_it_in_a_position(object_name, latest_frame, motion_
             return
         frame_copy = latest_frame.copy()
 
-    # Re-recognize a frame (you can also choose to use result_image directly)
-    result_image, rect_list, classnames = detector.infer(frame_copy)
-    print(f"{len(rect_list)} targets detected, category:{classnames}")
-
-    # Traverse to find matching categories
-    for idx, rect in enumerate(rect_list):
-        label = classnames[idx]
-        if label == object_name:
-            (x1, y1), width, height, *_ = rect
-            center_x = x1 + width // 2
-            center_y = y1 + height // 2
-            print(f"Found the target {object_name}, center point: ({center_x}, {center_y})")
-
-            # Execute the crawl
-            motion_control.convert_to_real_coordinates(center_x, center_y)
-            return f"✅ Crawled {object_name} "
-
-    return f"❌ No target of category '{object_name}' found, please try again"
+    not_found = f"❌ No target of category '{object_name}' found, please try again"
+    # Re-recognize a frame, only the requested category is scored
+    try:
+        detections = detector.infer(frame_copy, target_classes=[object_name])
+    except ValueError as e:
+        # A category the model does not know cannot be on the frame either
+        print(e)
+        return not_found
+    print(f"{len(detections)} targets detected, category:{detections.names}")
+
+    # Centre of the highest scoring box of the requested category
+    center = detections.best(object_name)
+    if center is not None:
+        center_x, center_y = center
+        print(f"Found the target {object_name}, center point: ({center_x}, {center_y})")
+
+        # Execute the crawl
+        motion_control.convert_to_real_coordinates(center_x, center_y)
+        return f"✅ Crawled {object_name} "
+
+    return not_found
 
 
 # Function name mapping table